@@ -1,7 +1,7 @@
 import logging
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.core import HomeAssistant
-from .const import DOMAIN, PLATFORMS, CONF_EXTERNAL_URL
+from .const import DOMAIN, PLATFORMS, CONF_EXTERNAL_URL, RELOAD_KEYS
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -25,26 +25,48 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
         _LOGGER.error("无法加载EncryptHelper模块: %s", str(e))
         return False
     
-    client = WorkChatClient(hass, config_data)
+    # 选项流程中修改的值覆盖初始配置
+    client = WorkChatClient(hass, {**config_data, **entry.options})
+    client.register()
     hass.data.setdefault(DOMAIN, {})[entry.entry_id] = client
     
     # 设置回调URL
     await client.setup_callback()
     
+    # 启动代理池健康检查
+    await client.setup_proxy_health_check()
+    
     # 设置实体平台 - 使用推荐的方法
     await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
     
     # 设置通知服务和媒体上传服务
     await client.setup_notify_service()
     await client.setup_media_services()
+    await client.setup_card_services()
+    await client.setup_appchat_services()
+    await client.setup_command_router()
+    await client.setup_trace_services()
     
     # 保存更新后的配置
     if entry.data != config_data:
         hass.config_entries.async_update_entry(entry, data=config_data)
     
+    # 选项变更时热更新客户端
+    entry.async_on_unload(entry.add_update_listener(_async_update_listener))
+    
     _LOGGER.info("企微通集成设置完成")
     return True
 
+async def _async_update_listener(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """选项变更：企业、Secret、AES Key 等变化时重新加载，其余选项直接应用到运行中的客户端"""
+    client = hass.data[DOMAIN][entry.entry_id]
+    config = {**entry.data, **entry.options}
+    if any(config.get(key) != client.config.get(key) for key in RELOAD_KEYS):
+        _LOGGER.info("企微通凭据已变更，重新加载集成")
+        await hass.config_entries.async_reload(entry.entry_id)
+        return
+    await client.apply_config(config)
+
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Unload a config entry."""
     client = hass.data[DOMAIN][entry.entry_id]
@@ -55,5 +77,6 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     
     if unload_ok:
         hass.data[DOMAIN].pop(entry.entry_id)
+        client.unregister()
     
     return unload_ok
@@ -0,0 +1,52 @@
+from homeassistant.helpers.storage import Store
+from homeassistant.util import dt as dt_util
+from .const import DOMAIN
+
+STORAGE_VERSION = 1
+# 合并写入存储的延迟（秒）
+SAVE_DELAY = 10
+
+
+class AppChatStore:
+    """群聊会话 chatid 与成员的本地缓存（持久化）"""
+
+    def __init__(self, hass, agent_id):
+        self._store = Store(hass, STORAGE_VERSION, f"{DOMAIN}.appchats.{agent_id}")
+        self._chats = {}
+
+    async def async_load(self):
+        self._chats = await self._store.async_load() or {}
+
+    def _save(self):
+        self._store.async_delay_save(lambda: self._chats, SAVE_DELAY)
+
+    def get(self, chatid):
+        return self._chats.get(chatid)
+
+    def set(self, chatid, name, owner, userlist):
+        self._chats[chatid] = {
+            "chatid": chatid,
+            "name": name,
+            "owner": owner,
+            "userlist": list(userlist),
+            "updated": dt_util.utcnow().isoformat(),
+        }
+        self._save()
+
+    def update(self, chatid, name=None, owner=None, add_user_list=None, del_user_list=None):
+        """按 appchat/update 的参数更新缓存"""
+        chat = self._chats.setdefault(
+            chatid, {"chatid": chatid, "name": None, "owner": None, "userlist": []}
+        )
+        if name:
+            chat["name"] = name
+        if owner:
+            chat["owner"] = owner
+        members = [u for u in chat["userlist"] if u not in (del_user_list or [])]
+        members.extend(u for u in (add_user_list or []) if u not in members)
+        chat["userlist"] = members
+        chat["updated"] = dt_util.utcnow().isoformat()
+        self._save()
+
+    def as_list(self):
+        return list(self._chats.values())
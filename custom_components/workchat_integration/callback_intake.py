@@ -0,0 +1,61 @@
+import re
+from .const import CALLBACK_MAX_BODY, CALLBACK_CONTENT_TYPES
+
+# Encrypt 字段只会出现在回调XML开头附近，超出该范围不再查找
+_SCAN_LIMIT = 512
+_ENCRYPT_OPEN = b"<Encrypt>"
+_ENCRYPT_CLOSE = b"</Encrypt>"
+_CDATA_OPEN = b"<![CDATA["
+_CDATA_CLOSE = b"]]>"
+_BASE64 = re.compile(rb"[A-Za-z0-9+/]+={0,2}")
+
+REQUIRED_QUERY = ("msg_signature", "timestamp", "nonce")
+
+
+class IntakeRejected(Exception):
+    """回调请求在进入解密流程前被拒绝"""
+
+    def __init__(self, reason, status=400):
+        super().__init__(reason)
+        self.reason = reason
+        self.status = status
+
+
+def check_request(request):
+    """在读取请求体之前完成的廉价检查：查询签名参数、Content-Type 和声明的长度"""
+    if any(not request.query.get(key) for key in REQUIRED_QUERY):
+        raise IntakeRejected("missing_signature")
+    content_type = request.headers.get("Content-Type", "").split(";")[0].strip().lower()
+    if content_type not in CALLBACK_CONTENT_TYPES:
+        raise IntakeRejected("bad_content_type", 415)
+    if request.content_length is not None and request.content_length > CALLBACK_MAX_BODY:
+        raise IntakeRejected("too_large", 413)
+
+
+async def read_body(request):
+    """流式读取请求体，超过大小上限立即中止"""
+    chunks = []
+    size = 0
+    async for chunk in request.content.iter_chunked(4096):
+        size += len(chunk)
+        if size > CALLBACK_MAX_BODY:
+            raise IntakeRejected("too_large", 413)
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def extract_encrypt(body):
+    """有界扫描提取 Encrypt 字段，不构建完整的XML树"""
+    start = body.find(_ENCRYPT_OPEN, 0, _SCAN_LIMIT)
+    if start == -1:
+        raise IntakeRejected("malformed")
+    start += len(_ENCRYPT_OPEN)
+    end = body.find(_ENCRYPT_CLOSE, start)
+    if end == -1:
+        raise IntakeRejected("malformed")
+    value = body[start:end].strip()
+    if value.startswith(_CDATA_OPEN) and value.endswith(_CDATA_CLOSE):
+        value = value[len(_CDATA_OPEN):-len(_CDATA_CLOSE)]
+    if not value or not _BASE64.fullmatch(value):
+        raise IntakeRejected("malformed")
+    return value.decode("ascii")
@@ -0,0 +1,76 @@
+import logging
+from homeassistant.helpers.storage import Store
+from homeassistant.util import dt as dt_util
+from .const import DOMAIN
+
+_LOGGER = logging.getLogger(__name__)
+
+STORAGE_VERSION = 1
+# 合并写入存储的延迟（秒）
+SAVE_DELAY = 10
+
+
+class TemplateCardStore:
+    """card_key 与 task_id 及企业微信返回的 msgid / response_code 的映射（持久化）"""
+
+    def __init__(self, hass, agent_id):
+        self._store = Store(hass, STORAGE_VERSION, f"{DOMAIN}.cards.{agent_id}")
+        self._cards = {}
+
+    async def async_load(self):
+        self._cards = await self._store.async_load() or {}
+
+    def _save(self):
+        self._store.async_delay_save(lambda: self._cards, SAVE_DELAY)
+
+    def get(self, card_key):
+        return self._cards.get(card_key)
+
+    def record_send(self, card_key, payload, response_data):
+        """记录发送结果，response_code 用于后续更新卡片"""
+        self._cards[card_key] = {
+            "msgid": response_data.get("msgid"),
+            "response_code": response_data.get("response_code"),
+            "touser": payload.get("touser"),
+            "task_id": payload.get("template_card", {}).get("task_id"),
+            "card_type": payload.get("template_card", {}).get("card_type"),
+            "updated": dt_util.utcnow().isoformat(),
+        }
+        self._save()
+
+    def resolve(self, task_id):
+        """交互回调中的 task_id 映射回 card_key"""
+        for card_key, card in self._cards.items():
+            if card.get("task_id") == task_id:
+                return card_key
+        # 旧版本直接以 card_key 作为 task_id
+        return task_id if task_id in self._cards else None
+
+    def update_response_code(self, card_key, response_code):
+        """交互回调会带来新的 response_code"""
+        card = self._cards.get(card_key)
+        if card is None:
+            return
+        card["response_code"] = response_code
+        card["updated"] = dt_util.utcnow().isoformat()
+        self._save()
+
+    def consume_response_code(self, card_key):
+        """response_code 只能使用一次，取出后清除"""
+        card = self._cards.get(card_key)
+        if card is None:
+            return None
+        code = card.pop("response_code", None)
+        self._save()
+        return code
+
+    def remove(self, card_key):
+        if self._cards.pop(card_key, None) is not None:
+            self._save()
+
+    def as_dict(self):
+        return {
+            key: {k: v for k, v in card.items() if k != "response_code"}
+            for key, card in self._cards.items()
+        }
+
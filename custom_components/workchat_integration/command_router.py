@@ -0,0 +1,135 @@
+import logging
+import voluptuous as vol
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers import config_validation as cv
+from homeassistant.util.yaml import load_yaml
+from .const import COMMANDS_FILE
+
+_LOGGER = logging.getLogger(__name__)
+
+COMMAND_SCHEMA = vol.All(
+    vol.Schema({
+        vol.Required("name"): cv.string,
+        vol.Optional("command"): cv.string,
+        vol.Optional("event_key"): cv.string,
+        vol.Optional("args", default=[]): vol.All(cv.ensure_list, [cv.string]),
+        # 允许参数紧跟在命令之后（如 "温度25"），默认命令后必须是空白或文本结尾
+        vol.Optional("attached_args", default=False): cv.boolean,
+        vol.Optional("service"): cv.service,
+        vol.Optional("data", default={}): dict,
+    }),
+    cv.has_at_least_one_key("command", "event_key"),
+)
+COMMANDS_SCHEMA = vol.All(cv.ensure_list, [COMMAND_SCHEMA])
+
+
+class CommandTrie:
+    """前缀树：按字符匹配最长的命令前缀，命令必须在空白或文本结尾处结束"""
+
+    def __init__(self):
+        self._root = {}
+
+    def add(self, prefix, value):
+        node = self._root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[None] = value
+
+    def match(self, text):
+        """返回 (命令配置, 剩余文本)，未匹配返回 (None, text)；耗时与文本长度成正比"""
+        node = self._root
+        found, end = None, 0
+        for index, char in enumerate(text):
+            node = node.get(char)
+            if node is None:
+                break
+            value = node.get(None)
+            if value is None:
+                continue
+            # 避免 "on" 命中 "online"：之后必须是空白或文本结尾，除非命令允许参数紧跟
+            at_boundary = index + 1 == len(text) or text[index + 1].isspace()
+            if at_boundary or value.get("attached_args"):
+                found, end = value, index + 1
+        if found is None:
+            return None, text
+        return found, text[end:]
+
+
+class CommandRouter:
+    """入站命令路由：文本命令和菜单 EventKey 编译为前缀树，命中后触发定向事件或调用服务"""
+
+    def __init__(self, hass):
+        self.hass = hass
+        self._text = CommandTrie()
+        self._menu = CommandTrie()
+        self.count = 0
+
+    async def async_load(self):
+        """从配置目录加载命令表并编译"""
+        path = self.hass.config.path(COMMANDS_FILE)
+
+        def _load():
+            try:
+                return load_yaml(path)
+            except FileNotFoundError:
+                return None
+
+        try:
+            raw = await self.hass.async_add_executor_job(_load)
+            commands = COMMANDS_SCHEMA(raw or [])
+        except (HomeAssistantError, vol.Invalid) as e:
+            _LOGGER.error("命令表 %s 无效: %s", COMMANDS_FILE, str(e))
+            return
+        self.compile(commands)
+        _LOGGER.info("已加载 %s 条企微通命令", self.count)
+
+    def compile(self, commands):
+        text, menu = CommandTrie(), CommandTrie()
+        for command in commands:
+            if "command" in command:
+                text.add(command["command"], command)
+            if "event_key" in command:
+                menu.add(command["event_key"], command)
+        self._text, self._menu, self.count = text, menu, len(commands)
+
+    def dispatch(self, event_data):
+        """匹配入站消息，命中时返回命令名称"""
+        if event_data["type"] == "text":
+            source, trie, text = "text", self._text, (event_data.get("content") or "").strip()
+        elif event_data["type"] == "menu_click":
+            source, trie, text = "menu", self._menu, event_data.get("event_key") or ""
+        else:
+            return None
+
+        command, rest = trie.match(text)
+        if command is None:
+            return None
+
+        arg_list = rest.split()
+        names = command["args"]
+        args = dict(zip(names, arg_list))
+        if names and len(arg_list) > len(names):
+            # 多余的参数合并到最后一个参数中
+            args[names[-1]] = " ".join(arg_list[len(names) - 1:])
+
+        self.hass.bus.async_fire("workchat_command", {
+            "name": command["name"],
+            "source": source,
+            "args": args,
+            "arg_list": arg_list,
+            "raw": rest.strip(),
+            "user": event_data.get("user"),
+            "agent_id": event_data.get("agent_id"),
+        })
+
+        if "service" in command:
+            self.hass.async_create_task(self._call_service(command, args))
+        return command["name"]
+
+    async def _call_service(self, command, args):
+        """调用命令映射的服务；参数来自用户输入，失败时只记录日志"""
+        domain, service = command["service"].split(".", 1)
+        try:
+            await self.hass.services.async_call(domain, service, {**command["data"], **args})
+        except (HomeAssistantError, vol.Invalid) as e:
+            _LOGGER.error("命令 %s 调用服务 %s 失败: %s", command["name"], command["service"], str(e))
@@ -1,8 +1,46 @@
 from __future__ import annotations
 import voluptuous as vol
 from homeassistant import config_entries
+from homeassistant.core import callback
 from homeassistant.data_entry_flow import FlowResult
 import re
+from .const import (
+    DEFAULT_CONNECT_TIMEOUT, DEFAULT_REQUEST_TIMEOUT, CONF_CONNECT_TIMEOUT, CONF_REQUEST_TIMEOUT,
+)
+from .proxy_pool import parse_proxy_list
+
+URL_PATTERN = re.compile(
+    r'^(https?)://'  # http:// 或 https://
+    r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+[A-Z]{2,6}\.?|'  # 域名
+    r'localhost|'  # localhost
+    r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  # IP
+    r'(?::\d+)?'  # 端口
+    r'(?:/?|[/?]\S+)$',
+    re.IGNORECASE
+)
+
+def is_valid_url(url):
+    """验证URL格式是否有效（允许空值）"""
+    if not url or not str(url).strip():
+        return True  # 空值、空白字符串都合法（用于可选 proxy）
+
+    return URL_PATTERN.match(url.strip()) is not None
+
+def validate_network_input(user_input):
+    """校验 external_url 与代理列表，返回错误字典；external_url 统一以 / 结尾"""
+    errors = {}
+    external_url = user_input.get("external_url", "")
+    if not is_valid_url(external_url):
+        errors["external_url"] = "invalid_url"
+
+    # 验证 proxy（可选，支持多个代理，逗号或换行分隔）
+    proxy_urls = parse_proxy_list(user_input.get("proxy", ""))
+    if not all(is_valid_url(url) for url in proxy_urls):
+        errors["proxy"] = "invalid_proxy_url"
+
+    if not errors and not external_url.endswith('/'):
+        user_input["external_url"] = external_url + '/'
+    return errors
 
 class WorkChatIntegrationFlowHandler(config_entries.ConfigFlow, domain="workchat_integration"):
     """配置流程处理"""
@@ -11,21 +49,9 @@ class WorkChatIntegrationFlowHandler(config_entries.ConfigFlow, domain="workchat
         errors = {}
 
         if user_input is not None:
-            # 验证 external_url
-            external_url = user_input.get("external_url", "")
-            if not self._is_valid_url(external_url):
-                errors["external_url"] = "invalid_url"
-
-            # 验证 proxy（可选）
-            proxy_url = user_input.get("proxy", "")
-            if not self._is_valid_url(proxy_url):
-                errors["proxy"] = "invalid_proxy_url"
+            errors = validate_network_input(user_input)
 
             if not errors:
-                # external_url 统一以 / 结尾
-                if not external_url.endswith('/'):
-                    user_input["external_url"] = external_url + '/'
-
                 return self.async_create_entry(
                     title="企微通集成",
                     data=user_input
@@ -48,6 +74,12 @@ class WorkChatIntegrationFlowHandler(config_entries.ConfigFlow, domain="workchat
 
             # 代理字段真正可选，默认空字符串
             vol.Optional("proxy", default=user_input.get("proxy", "") if user_input else ""): str,
+            # 所有代理都不可用时是否直连
+            vol.Optional("proxy_direct_fallback", default=user_input.get("proxy_direct_fallback", False) if user_input else False): bool,
+
+            # 群机器人（可选）：填写webhook key后可通过群机器人发送，无需Access Token
+            vol.Optional("webhook_key", default=user_input.get("webhook_key", "") if user_input else ""): str,
+            vol.Optional("default_transport", default=user_input.get("default_transport", "app") if user_input else "app"): vol.In(["app", "webhook"]),
         })
 
         return self.async_show_form(
@@ -55,24 +87,49 @@ class WorkChatIntegrationFlowHandler(config_entries.ConfigFlow, domain="workchat
             data_schema=data_schema,
             errors=errors,
             description_placeholders={
-                "proxy_help": "可选，用于通过代理服务器连接企业微信API。例如：http://您的VPS_IP:3128"
+                "proxy_help": "可选，用于通过代理服务器连接企业微信API。例如：http://您的VPS_IP:3128，多个代理用逗号分隔"
             }
         )
 
-    def _is_valid_url(self, url):
-        """验证URL格式是否有效（允许空值）"""
-        if not url or not str(url).strip():
-            return True  # 空值、空白字符串都合法（用于可选 proxy）
-
-        url = url.strip()
-
-        url_pattern = re.compile(
-            r'^(https?)://'  # http:// 或 https://
-            r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+[A-Z]{2,6}\.?|'  # 域名
-            r'localhost|'  # localhost
-            r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  # IP
-            r'(?::\d+)?'  # 端口
-            r'(?:/?|[/?]\S+)$',
-            re.IGNORECASE
+    @staticmethod
+    @callback
+    def async_get_options_flow(config_entry):
+        return WorkChatOptionsFlowHandler(config_entry)
+
+
+class WorkChatOptionsFlowHandler(config_entries.OptionsFlow):
+    """选项流程：修改后热更新运行中的客户端，企业、Secret 或 AES Key 变化时重新加载"""
+
+    def __init__(self, config_entry):
+        self._entry = config_entry
+
+    async def async_step_init(self, user_input=None) -> FlowResult:
+        errors = {}
+
+        if user_input is not None:
+            errors = validate_network_input(user_input)
+            if not errors:
+                return self.async_create_entry(title="", data=user_input)
+
+        current = {**self._entry.data, **self._entry.options, **(user_input or {})}
+
+        data_schema = vol.Schema({
+            vol.Required("corp_id", default=current.get("corp_id", "")): str,
+            vol.Required("secret", default=current.get("secret", "")): str,
+            vol.Required("aes_key", default=current.get("aes_key", "")): str,
+            vol.Required("receive_user", default=current.get("receive_user", "@all")): str,
+            vol.Required("external_url", default=current.get("external_url", "")): str,
+            vol.Optional("proxy", default=current.get("proxy", "")): str,
+            vol.Optional("proxy_direct_fallback", default=current.get("proxy_direct_fallback", False)): bool,
+            vol.Optional("webhook_key", default=current.get("webhook_key", "")): str,
+            vol.Optional("default_transport", default=current.get("default_transport", "app")): vol.In(["app", "webhook"]),
+            # 连接超时较短便于快速切换代理；读取超时用于普通接口（上传接口固定为30秒）
+            vol.Optional(CONF_CONNECT_TIMEOUT, default=current.get(CONF_CONNECT_TIMEOUT, DEFAULT_CONNECT_TIMEOUT)): vol.All(vol.Coerce(float), vol.Range(min=1, max=60)),
+            vol.Optional(CONF_REQUEST_TIMEOUT, default=current.get(CONF_REQUEST_TIMEOUT, DEFAULT_REQUEST_TIMEOUT)): vol.All(vol.Coerce(float), vol.Range(min=1, max=120)),
+        })
+
+        return self.async_show_form(
+            step_id="init",
+            data_schema=data_schema,
+            errors=errors,
         )
-        return re.match(url_pattern, url) is not None
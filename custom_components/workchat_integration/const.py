@@ -1,4 +1,4 @@
-PLATFORMS = ["sensor"]
+PLATFORMS = ["sensor", "device_tracker"]
 DOMAIN = "workchat_integration"
 
 CONF_CORP_ID = "corp_id"
@@ -8,7 +8,79 @@ CONF_TOKEN = "token"
 CONF_AES_KEY = "aes_key"
 CONF_RECEIVE_USER = "receive_user"
 CONF_EXTERNAL_URL = "external_url"
-CONF_PROXY = "proxy"  # 新增：代理配置
+CONF_PROXY = "proxy"  # 新增：代理配置（支持多个，逗号或换行分隔）
+CONF_PROXY_DIRECT_FALLBACK = "proxy_direct_fallback"  # 所有代理不可用时直连
+CONF_WEBHOOK_KEY = "webhook_key"  # 群机器人webhook key
+CONF_DEFAULT_TRANSPORT = "default_transport"  # 默认发送通道
+CONF_CONNECT_TIMEOUT = "connect_timeout"  # 连接超时（秒）
+CONF_REQUEST_TIMEOUT = "request_timeout"  # 请求读取超时（秒）
+
+# 以下配置变更时需要重新加载条目，其余选项可在运行中热更新
+RELOAD_KEYS = (CONF_CORP_ID, CONF_SECRET, CONF_AES_KEY, CONF_TOKEN, CONF_AGENT_ID)
+
+# 发送通道：应用消息 / 群机器人
+TRANSPORT_APP = "app"
+TRANSPORT_WEBHOOK = "webhook"
+# 应用媒体文件大小上限
+MEDIA_MAX_SIZE = 10 * 1024 * 1024
+# 摄像头快照重新压缩的默认JPEG质量
+SNAPSHOT_DEFAULT_QUALITY = 75
+# 群机器人图片消息大小上限
+WEBHOOK_IMAGE_MAX_SIZE = 2 * 1024 * 1024
+
+# 企业级注册表在 hass.data 中的键
+DATA_CORP_REGISTRY = f"{DOMAIN}_corp_registry"
+# 回调视图在 hass.data 中的键（视图只注册一次，按URL中的Token查找客户端）
+DATA_CALLBACK_VIEW = f"{DOMAIN}_callback_view"
+# 同一应用每分钟发送次数达到该值时，应用池切换到其他应用发送
+AGENT_POOL_MINUTE_LIMIT = 100
+# 客户端限流默认值：{接口: (每分钟次数, 突发容量)}
+# 参考企业微信文档：每应用对同一成员发送消息不超过30次/分钟（超出部分被丢弃），
+# 单个接口调用频率受企业级上限约束，这里按家庭场景取保守值
+RATE_LIMITS = {
+    "message": (200, 20),
+    "upload": (30, 5),
+    # 每个群机器人发送消息不超过20条/分钟
+    "webhook": (20, 5),
+    "recipient": (30, 10),
+}
+# 企业微信频率限制错误码
+RATE_LIMIT_ERRCODES = (45009, 45033, 45047)
+# 触发频率限制后的重试间隔（秒，按次数递增）与最大重试次数
+RATE_LIMIT_RETRY_DELAY = 30
+RATE_LIMIT_MAX_RETRIES = 3
+# 告警去重默认抑制窗口（秒）
+DEDUP_DEFAULT_WINDOW = 300
+# 定时发送时间轮每个槽的时长（秒）
+SCHEDULE_SLOT_SECONDS = 60
+# 合并延迟消息时单条消息内容的长度上限（字节），按发送通道区分：
+# 应用消息的 markdown 上限为2048字节，群机器人为4096字节
+MERGE_MAX_BYTES = {
+    TRANSPORT_APP: {"text": 2048, "markdown": 2048},
+    TRANSPORT_WEBHOOK: {"text": 2048, "markdown": 4096},
+}
+# 入站命令表文件（位于配置目录）
+COMMANDS_FILE = "workchat_commands.yaml"
+# 位置上报合并窗口（秒）与最小移动距离（米）
+LOCATION_COALESCE_SECONDS = 5
+LOCATION_MIN_DISTANCE = 50
+# 请求追踪：写入配置目录下的滚动 JSONL 文件
+TRACE_FILE = "workchat_traces.jsonl"
+TRACE_SAMPLE_RATE = 0.1  # 采样率；慢请求和出错的请求总是记录
+TRACE_SLOW_MS = 1000
+TRACE_MAX_BYTES = 1024 * 1024
+TRACE_BACKUP_COUNT = 3
+# 回调请求体大小上限（字节）与允许的 Content-Type（空值表示未携带）
+CALLBACK_MAX_BODY = 64 * 1024
+CALLBACK_CONTENT_TYPES = ("", "text/xml", "application/xml", "text/plain")
+# Access Token 无效或过期的错误码
+TOKEN_INVALID_ERRCODES = (40014, 42001)
 
 # 企业微信API基础URL
 API_BASE = "https://qyapi.weixin.qq.com/cgi-bin"
+
+# 网络超时（秒）：连接阶段使用较短超时，便于快速切换代理
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_REQUEST_TIMEOUT = 10
+# 代理健康检查间隔（秒）
+PROXY_PROBE_INTERVAL = 60
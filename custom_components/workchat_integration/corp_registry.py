@@ -0,0 +1,95 @@
+import time
+import asyncio
+import logging
+from .const import DATA_CORP_REGISTRY, AGENT_POOL_MINUTE_LIMIT
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class SharedToken:
+    """同一企业同一Secret共享的Access Token缓存"""
+
+    def __init__(self):
+        self.access_token = None
+        self.expire = 0
+        # 避免多个配置条目同时刷新同一个Token
+        self.lock = asyncio.Lock()
+        self.refs = 0
+
+    def valid(self):
+        return bool(self.access_token) and time.time() < self.expire - 60
+
+    def update(self, access_token, expires_in):
+        self.access_token = access_token
+        self.expire = time.time() + expires_in
+
+    def invalidate(self):
+        self.access_token = None
+        self.expire = 0
+
+
+class CorpRegistry:
+    """企业级注册表：按 corp_id 管理客户端，共享Token并提供多应用发送池"""
+
+    def __init__(self):
+        self._tokens = {}
+        self._clients = {}
+
+    def register(self, client):
+        """登记客户端并返回其共享Token缓存"""
+        corp_id = client.config["corp_id"]
+        key = (corp_id, client.config["secret"])
+        token = self._tokens.get(key)
+        if token is None:
+            token = self._tokens[key] = SharedToken()
+        token.refs += 1
+        self._clients.setdefault(corp_id, {})[str(client.config["agent_id"])] = client
+        _LOGGER.debug("企业 %s 已登记应用: %s", corp_id, list(self._clients[corp_id]))
+        return token
+
+    def unregister(self, client):
+        corp_id = client.config["corp_id"]
+        key = (corp_id, client.config["secret"])
+        token = self._tokens.get(key)
+        if token is not None:
+            token.refs -= 1
+            if token.refs <= 0:
+                self._tokens.pop(key)
+        agents = self._clients.get(corp_id, {})
+        if agents.get(str(client.config["agent_id"])) is client:
+            agents.pop(str(client.config["agent_id"]))
+        if not agents:
+            self._clients.pop(corp_id, None)
+
+    def get_agent(self, corp_id, agent_id):
+        """按 agent_id 获取同一企业下的客户端"""
+        return self._clients.get(corp_id, {}).get(str(agent_id))
+
+    def agents(self, corp_id):
+        return list(self._clients.get(corp_id, {}).values())
+
+    def pick_agent(self, client):
+        """从同一企业的应用池中选择发送应用
+
+        当前应用未接近发送上限时直接使用，否则选择限流等待最短、
+        最近一分钟发送量最少的应用。
+        """
+        if (client.recent_send_count() < AGENT_POOL_MINUTE_LIMIT
+                and client.rate_limiter.wait_time("message") == 0):
+            return client
+        pool = self.agents(client.config["corp_id"]) or [client]
+        chosen = min(pool, key=lambda c: (
+            c.rate_limiter.wait_time("message"), c.recent_send_count()
+        ))
+        if chosen is not client:
+            _LOGGER.debug("应用 %s 接近发送上限，切换到应用 %s",
+                          client.config["agent_id"], chosen.config["agent_id"])
+        return chosen
+
+
+def get_corp_registry(hass):
+    """获取（必要时创建）全局企业注册表"""
+    registry = hass.data.get(DATA_CORP_REGISTRY)
+    if registry is None:
+        registry = hass.data[DATA_CORP_REGISTRY] = CorpRegistry()
+    return registry
@@ -0,0 +1,106 @@
+import re
+import hashlib
+import logging
+from homeassistant.helpers.event import async_call_later
+from homeassistant.util import dt as dt_util
+
+_LOGGER = logging.getLogger(__name__)
+
+# 参与指纹计算的文本字段
+_TEXT_FIELDS = ("title", "message", "description")
+_DIGITS = re.compile(r"\d+(?:\.\d+)?")
+_SPACES = re.compile(r"\s+")
+# 摘要消息沿用原消息的发送目标与通道
+ROUTING_FIELDS = (
+    "touser", "chatid", "agent_id", "agent_pool", "priority", "transport", "webhook_key",
+)
+
+
+def fingerprint(data):
+    """根据消息内容生成归一化指纹：忽略大小写、空白和数字差异"""
+    parts = [
+        str(data.get("msg_type", "text")),
+        str(data.get("touser", "")),
+        str(data.get("chatid", "")),
+    ]
+    for field in _TEXT_FIELDS:
+        text = str(data.get(field, "")).lower()
+        text = _DIGITS.sub("#", text)
+        parts.append(_SPACES.sub(" ", text).strip())
+    return hashlib.sha1("\x1f".join(parts).encode()).hexdigest()
+
+
+class _DedupWindow:
+    """一个抑制窗口内的相似告警"""
+
+    def __init__(self, data):
+        self.data = data
+        self.started = dt_util.now()
+        self.suppressed = 0
+        self.last_data = data
+        self.unsub = None
+
+
+class AlertDeduplicator:
+    """告警风暴去重：窗口内的相似消息被抑制，窗口结束时合并为一条摘要"""
+
+    def __init__(self, hass, send):
+        self.hass = hass
+        # send(data) 为实际发送消息的协程函数
+        self._send = send
+        self._windows = {}
+        self.total_suppressed = 0
+        self.total_digests = 0
+
+    def check(self, data, key, window):
+        """返回 True 表示应立即发送；False 表示已被抑制，稍后合并到摘要"""
+        key = key or fingerprint(data)
+        current = self._windows.get(key)
+        if current is not None:
+            current.suppressed += 1
+            current.last_data = data
+            self.total_suppressed += 1
+            _LOGGER.debug("抑制相似告警 %s，窗口内已抑制 %s 条", key[:8], current.suppressed)
+            return False
+        current = _DedupWindow(data)
+
+        async def _flush(now):
+            await self._flush(key)
+
+        # 先设置定时器再登记窗口，定时器设置失败时不会留下永不结束的窗口
+        current.unsub = async_call_later(self.hass, window, _flush)
+        self._windows[key] = current
+        return True
+
+    async def _flush(self, key):
+        current = self._windows.pop(key, None)
+        if current is None or not current.suppressed:
+            return
+        last = current.last_data
+        content = last.get("message") or last.get("title") or last.get("description", "")
+        digest = (
+            f"**{current.suppressed} 条相似告警**（自 "
+            f"{current.started.strftime('%H:%M:%S')} 起）\n"
+            f"> {content}"
+        )
+        self.total_digests += 1
+        data = {
+            k: v for k, v in last.items()
+            if k in ROUTING_FIELDS
+        }
+        data.update({"msg_type": "markdown", "message": digest})
+        await self._send(data)
+
+    async def async_flush_all(self):
+        """立即发送所有未完成窗口的摘要（卸载时调用）"""
+        for key, current in list(self._windows.items()):
+            if current.unsub:
+                current.unsub()
+            await self._flush(key)
+
+    def as_dict(self):
+        return {
+            "open_windows": len(self._windows),
+            "total_suppressed": self.total_suppressed,
+            "total_digests": self.total_digests,
+        }
@@ -0,0 +1,192 @@
+import logging
+from homeassistant.components.device_tracker import SourceType, TrackerEntity
+from homeassistant.core import callback
+from homeassistant.helpers import entity_registry as er
+from homeassistant.helpers.event import async_call_later
+from homeassistant.helpers.restore_state import RestoreEntity
+from homeassistant.util import dt as dt_util
+from homeassistant.util.location import distance
+from .const import DOMAIN, LOCATION_COALESCE_SECONDS, LOCATION_MIN_DISTANCE
+
+_LOGGER = logging.getLogger(__name__)
+
+# 位置消息与定时上报位置事件
+LOCATION_TYPES = ("location", "location_report")
+
+
+def scale_to_accuracy(scale):
+    """根据地图缩放级别估算定位精度（米）：按该级别每像素对应的地面距离 × 10 估算"""
+    if scale is None:
+        return 0
+    return round(156543.03 / 2 ** float(scale) * 10)
+
+
+class WorkChatUserTracker(TrackerEntity, RestoreEntity):
+    """企微通成员位置追踪实体"""
+
+    _attr_has_entity_name = True
+    _attr_should_poll = False
+    _attr_icon = "mdi:account-badge"
+
+    def __init__(self, entry, user):
+        self.user = user
+        self._attr_unique_id = f"{entry.entry_id}-tracker-{user}"
+        self._attr_name = f"企微通位置 {user}"
+        self._latitude = None
+        self._longitude = None
+        self._accuracy = 0
+        self._label = None
+        self._reported_at = None
+
+    async def async_added_to_hass(self):
+        """恢复上次位置"""
+        await super().async_added_to_hass()
+        if self._latitude is not None:
+            return
+        last_state = await self.async_get_last_state()
+        if last_state is None:
+            return
+        self._latitude = last_state.attributes.get("latitude")
+        self._longitude = last_state.attributes.get("longitude")
+        self._accuracy = last_state.attributes.get("gps_accuracy", 0)
+        self._label = last_state.attributes.get("label")
+        self._reported_at = last_state.attributes.get("reported_at")
+
+    @property
+    def source_type(self):
+        return SourceType.GPS
+
+    @property
+    def latitude(self):
+        return self._latitude
+
+    @property
+    def longitude(self):
+        return self._longitude
+
+    @property
+    def location_accuracy(self):
+        return self._accuracy
+
+    @property
+    def extra_state_attributes(self):
+        return {
+            "user": self.user,
+            "label": self._label,
+            "reported_at": self._reported_at,
+        }
+
+    def should_update(self, sample):
+        """移动距离小于阈值且精度没有明显提升时丢弃本次更新"""
+        if self._latitude is None or self._longitude is None:
+            return True
+        moved = distance(self._latitude, self._longitude, sample["lat"], sample["lon"])
+        if moved is None or moved >= LOCATION_MIN_DISTANCE:
+            return True
+        return bool(sample["accuracy"]) and sample["accuracy"] < self._accuracy / 2
+
+    def apply(self, sample):
+        self._latitude = sample["lat"]
+        self._longitude = sample["lon"]
+        self._accuracy = sample["accuracy"]
+        if sample.get("label"):
+            self._label = sample["label"]
+        self._reported_at = sample["reported_at"]
+
+
+class LocationCoalescer:
+    """合并短时间内的位置上报，每个成员只保留最新一条"""
+
+    def __init__(self, hass, entry, async_add_entities):
+        self.hass = hass
+        self._entry = entry
+        self._add_entities = async_add_entities
+        self.trackers = {}
+        self._pending = {}
+        self._unsub_flush = None
+        self.dropped = 0
+
+    def add_restored(self, users):
+        entities = []
+        for user in users:
+            if user not in self.trackers:
+                self.trackers[user] = WorkChatUserTracker(self._entry, user)
+                entities.append(self.trackers[user])
+        if entities:
+            self._add_entities(entities)
+
+    def handle_event(self, event_data):
+        try:
+            lat = float(event_data["lat"])
+            lon = float(event_data["lon"])
+        except (KeyError, TypeError, ValueError):
+            _LOGGER.debug("位置数据无效: %s", event_data)
+            return
+        if event_data["type"] == "location_report":
+            accuracy = float(event_data.get("precision") or 0)
+        else:
+            accuracy = scale_to_accuracy(event_data.get("scale"))
+        self._pending[event_data["user"]] = {
+            "lat": lat,
+            "lon": lon,
+            "accuracy": accuracy,
+            "label": event_data.get("label"),
+            "reported_at": dt_util.utcnow().isoformat(),
+        }
+        if self._unsub_flush is None:
+            self._unsub_flush = async_call_later(
+                self.hass, LOCATION_COALESCE_SECONDS, self._flush
+            )
+
+    @callback
+    def _flush(self, now=None):
+        self._unsub_flush = None
+        pending, self._pending = self._pending, {}
+        new_entities = []
+        for user, sample in pending.items():
+            tracker = self.trackers.get(user)
+            if tracker is None:
+                tracker = self.trackers[user] = WorkChatUserTracker(self._entry, user)
+                tracker.apply(sample)
+                new_entities.append(tracker)
+                continue
+            if not tracker.should_update(sample):
+                self.dropped += 1
+                continue
+            tracker.apply(sample)
+            if tracker.hass is not None:
+                tracker.async_write_ha_state()
+        if new_entities:
+            self._add_entities(new_entities)
+
+    def cancel(self):
+        if self._unsub_flush:
+            self._unsub_flush()
+            self._unsub_flush = None
+
+
+async def async_setup_entry(hass, entry, async_add_entities):
+    """为每个发送过位置的企微通成员创建位置追踪实体"""
+    client = hass.data[DOMAIN][entry.entry_id]
+    coalescer = LocationCoalescer(hass, entry, async_add_entities)
+    client.location_coalescer = coalescer
+
+    # 重启后按实体注册表恢复已有成员
+    prefix = f"{entry.entry_id}-tracker-"
+    registry = er.async_get(hass)
+    coalescer.add_restored([
+        reg_entry.unique_id[len(prefix):]
+        for reg_entry in er.async_entries_for_config_entry(registry, entry.entry_id)
+        if reg_entry.domain == "device_tracker" and reg_entry.unique_id.startswith(prefix)
+    ])
+
+    @callback
+    def _handle_message(event):
+        if event.data.get("type") not in LOCATION_TYPES:
+            return
+        if str(event.data.get("agent_id")) != str(client.config["agent_id"]):
+            return
+        coalescer.handle_event(event.data)
+
+    entry.async_on_unload(hass.bus.async_listen("workchat_message", _handle_message))
+    entry.async_on_unload(coalescer.cancel)
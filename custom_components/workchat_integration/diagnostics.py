@@ -0,0 +1,42 @@
+from homeassistant.components.diagnostics import async_redact_data
+from .const import (
+    DOMAIN, DATA_CALLBACK_VIEW, CONF_SECRET, CONF_TOKEN, CONF_AES_KEY, CONF_PROXY, CONF_WEBHOOK_KEY,
+)
+
+# 诊断信息中需要隐藏的敏感字段（群机器人key可直接向群发送消息）
+TO_REDACT = {CONF_SECRET, CONF_TOKEN, CONF_AES_KEY, CONF_PROXY, CONF_WEBHOOK_KEY}
+
+
+async def async_get_config_entry_diagnostics(hass, entry):
+    """返回配置条目的诊断信息"""
+    client = hass.data[DOMAIN][entry.entry_id]
+    view = hass.data.get(DATA_CALLBACK_VIEW)
+    return {
+        "config": async_redact_data(dict(client.config), TO_REDACT),
+        # 每个代理出口的延迟移动平均与健康状态
+        "proxy_pool": client.proxy_pool.as_dict(),
+        # 客户端限流状态与各优先级通道的等待时间
+        "rate_limiter": client.rate_limiter.as_dict(),
+        # 告警去重统计
+        "dedup": client.deduplicator.as_dict(),
+        # 定时与免打扰时段延迟发送的消息
+        "scheduler": client.scheduler.as_dict(),
+        # 已发送的模板卡片
+        "template_cards": client.cards.as_dict(),
+        # 成员位置追踪：追踪人数与被合并丢弃的上报次数
+        "location_trackers": {
+            "users": len(client.location_coalescer.trackers),
+            "dropped_updates": client.location_coalescer.dropped,
+        } if client.location_coalescer else None,
+        # 回调请求按原因统计的拒绝次数
+        "callback_rejections": dict(client.intake_rejections),
+        # Token 不匹配任何配置条目的回调请求（所有条目共用）
+        "callback_unmatched_token": view.rejections["bad_token"] if view else 0,
+        # 本地缓存的群聊会话
+        "appchats": client.appchats.as_list(),
+        # 同一企业下登记的应用及最近一分钟发送量
+        "corp_agents": {
+            str(agent.config["agent_id"]): agent.recent_send_count()
+            for agent in client.corp_registry.agents(client.config["corp_id"])
+        },
+    }
@@ -0,0 +1,214 @@
+import base64
+import hashlib
+import voluptuous as vol
+from homeassistant.helpers import config_validation as cv
+from .const import TRANSPORT_APP, TRANSPORT_WEBHOOK
+
+# 消息体构建器：应用消息（message/send）与群机器人（webhook/send）共用
+# 每种消息类型的参数 schema 在模块加载时编译一次，发送前（获取Token之前）校验
+
+# 需要 task_id 才能回调交互事件的模板卡片类型
+INTERACTIVE_CARD_TYPES = (
+    "button_interaction",
+    "vote_interaction",
+    "multiple_interaction",
+)
+
+
+def _text(data):
+    return {"content": data["message"]}
+
+
+def _webhook_text(data):
+    body = _text(data)
+    # 群机器人支持 @ 成员
+    if data.get("mentioned_list"):
+        body["mentioned_list"] = data["mentioned_list"]
+    if data.get("mentioned_mobile_list"):
+        body["mentioned_mobile_list"] = data["mentioned_mobile_list"]
+    return body
+
+
+def _markdown(data):
+    return {"content": data["message"]}
+
+
+def _media(data):
+    return {"media_id": data["media_id"]}
+
+
+def _textcard(data):
+    return {
+        "title": data["title"],
+        "description": data["message"],
+        "url": data["url"],
+        "btntxt": data.get("btntxt", "详情")
+    }
+
+
+def _news(data):
+    articles = data.get("articles", [])
+    if not articles and data.get("title"):
+        articles = [{
+            "title": data["title"],
+            "description": data.get("description", data.get("message", "")),
+            "url": data.get("url", ""),
+            "picurl": data.get("picurl", "")
+        }]
+    return {"articles": articles}
+
+
+def _video(data):
+    return {
+        "media_id": data["media_id"],
+        "title": data.get("title", ""),
+        "description": data.get("description", "")
+    }
+
+
+def _template_card(data):
+    # 交互型卡片需要 task_id 才能回调事件；由发送方按 card_key 生成，未提供时使用 card_key
+    card = dict(data["template_card"])
+    if data.get("card_key") and card.get("card_type") in INTERACTIVE_CARD_TYPES:
+        card.setdefault("task_id", data.get("task_id") or data["card_key"])
+    return card
+
+
+def _webhook_image(data):
+    # 群机器人图片消息使用图片内容的 base64 与 md5
+    content = data["image_bytes"]
+    return {
+        "base64": base64.b64encode(content).decode(),
+        "md5": hashlib.md5(content).hexdigest()
+    }
+
+
+def _schema(fields, *validators):
+    """消息参数 schema：只校验本类型需要的字段，其余字段（接收人、路由等）原样保留"""
+    return vol.All(vol.Schema(fields, extra=vol.ALLOW_EXTRA), *validators)
+
+
+ARTICLE_SCHEMA = vol.Schema({
+    vol.Required("title"): cv.string,
+    vol.Optional("description"): cv.string,
+    vol.Optional("url"): cv.string,
+    vol.Optional("picurl"): cv.string,
+}, extra=vol.ALLOW_EXTRA)
+
+TEXT_SCHEMA = _schema({vol.Required("message"): cv.string})
+MEDIA_SCHEMA = _schema({vol.Required("media_id"): cv.string})
+TEXTCARD_SCHEMA = _schema({
+    vol.Required("title"): cv.string,
+    vol.Required("message"): cv.string,
+    vol.Required("url"): cv.string,
+    vol.Optional("btntxt"): cv.string,
+})
+NEWS_SCHEMA = _schema(
+    {
+        vol.Optional("articles"): vol.All(cv.ensure_list, [ARTICLE_SCHEMA]),
+        vol.Optional("title"): cv.string,
+    },
+    cv.has_at_least_one_key("articles", "title"),
+)
+VIDEO_SCHEMA = _schema({
+    vol.Required("media_id"): cv.string,
+    vol.Optional("title"): cv.string,
+    vol.Optional("description"): cv.string,
+})
+TEMPLATE_CARD_SCHEMA = _schema({
+    vol.Required("template_card"): vol.Schema(
+        {vol.Required("card_type"): cv.string}, extra=vol.ALLOW_EXTRA
+    ),
+})
+WEBHOOK_TEXT_SCHEMA = _schema({
+    vol.Required("message"): cv.string,
+    vol.Optional("mentioned_list"): vol.All(cv.ensure_list, [cv.string]),
+    vol.Optional("mentioned_mobile_list"): vol.All(cv.ensure_list, [cv.string]),
+})
+# 群机器人图片可由本地文件或内存中的图片内容发送；文件和语音可先上传再发送
+WEBHOOK_IMAGE_SCHEMA = _schema({}, cv.has_at_least_one_key("file_path", "image_bytes"))
+WEBHOOK_MEDIA_SCHEMA = _schema({}, cv.has_at_least_one_key("media_id", "file_path"))
+
+
+class MessageRegistry:
+    """消息类型注册表：msg_type -> (参数 schema, 消息体构建器)"""
+
+    def __init__(self, name, entries):
+        self.name = name
+        self._entries = entries
+
+    def __contains__(self, msg_type):
+        return msg_type in self._entries
+
+    def _entry(self, msg_type):
+        entry = self._entries.get(msg_type)
+        if entry is None:
+            raise vol.Invalid(f"{self.name}不支持的消息类型: {msg_type}", path=["msg_type"])
+        return entry
+
+    def validate(self, data):
+        """校验消息参数，无效时抛出 vol.Invalid"""
+        schema, _ = self._entry(data.get("msg_type", "text"))
+        return schema(data)
+
+    def build(self, data):
+        """校验并构建消息体"""
+        msg_type = data.get("msg_type", "text")
+        schema, builder = self._entry(msg_type)
+        return builder(schema(data))
+
+
+_APP_ENTRIES = {
+    "text": (TEXT_SCHEMA, _text),
+    "image": (MEDIA_SCHEMA, _media),
+    "file": (MEDIA_SCHEMA, _media),
+    "textcard": (TEXTCARD_SCHEMA, _textcard),
+    "news": (NEWS_SCHEMA, _news),
+    "markdown": (TEXT_SCHEMA, _markdown),
+    "voice": (MEDIA_SCHEMA, _media),
+    "video": (VIDEO_SCHEMA, _video),
+    "template_card": (TEMPLATE_CARD_SCHEMA, _template_card),
+}
+
+APP_MESSAGES = MessageRegistry("应用消息", _APP_ENTRIES)
+
+# 群聊会话（appchat/send）不支持模板卡片
+APPCHAT_MESSAGES = MessageRegistry("群聊消息", {
+    msg_type: entry for msg_type, entry in _APP_ENTRIES.items() if msg_type != "template_card"
+})
+
+WEBHOOK_MESSAGES = MessageRegistry("群机器人", {
+    "text": (WEBHOOK_TEXT_SCHEMA, _webhook_text),
+    "markdown": (TEXT_SCHEMA, _markdown),
+    "image": (WEBHOOK_IMAGE_SCHEMA, _webhook_image),
+    "news": (NEWS_SCHEMA, _news),
+    "file": (WEBHOOK_MEDIA_SCHEMA, _media),
+    "voice": (WEBHOOK_MEDIA_SCHEMA, _media),
+    "template_card": (TEMPLATE_CARD_SCHEMA, _template_card),
+})
+
+# notify 服务的通用字段；按消息类型的校验由客户端根据发送通道追加
+NOTIFY_SCHEMA = vol.Schema({
+    vol.Optional("msg_type", default="text"): cv.string,
+    vol.Optional("transport"): vol.In([TRANSPORT_APP, TRANSPORT_WEBHOOK]),
+    # 保密消息：0 可对外分享，1 不能分享且显示水印，2 仅限企业内分享
+    vol.Optional("safe"): vol.All(vol.Coerce(int), vol.In([0, 1, 2])),
+    # 企业微信服务端重复消息检查，间隔最长4小时
+    vol.Optional("enable_duplicate_check"): cv.boolean,
+    vol.Optional("duplicate_check_interval"): vol.All(
+        vol.Coerce(int), vol.Range(min=1, max=14400)
+    ),
+    # 客户端告警去重
+    vol.Optional("dedup"): cv.boolean,
+    vol.Optional("dedup_key"): cv.string,
+    vol.Optional("dedup_window"): vol.All(vol.Coerce(int), vol.Range(min=1)),
+}, extra=vol.ALLOW_EXTRA)
+
+
+def message_options(data, fields=("safe", "enable_duplicate_check", "duplicate_check_interval")):
+    """应用消息的可选字段（保密与服务端去重）"""
+    return {
+        field: int(data[field])
+        for field in fields
+        if data.get(field) is not None
+    }
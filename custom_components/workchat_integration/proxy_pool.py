@@ -0,0 +1,169 @@
+import re
+import time
+import logging
+import threading
+from urllib.parse import urlsplit
+
+_LOGGER = logging.getLogger(__name__)
+
+# 延迟移动平均的平滑系数
+LATENCY_ALPHA = 0.3
+# 被剔除代理的退避时间（秒）
+EJECT_BASE_SECONDS = 15
+EJECT_MAX_SECONDS = 300
+
+DIRECT_NAME = "direct"
+
+# 请求URL中的查询参数（corpsecret、access_token、webhook key 等）
+_QUERY = re.compile(r"\?[^\s'\"()]*")
+
+
+def parse_proxy_list(value):
+    """解析代理配置，支持逗号、分号、空白或换行分隔的多个代理"""
+    if not value:
+        return []
+    if isinstance(value, (list, tuple)):
+        items = value
+    else:
+        items = re.split(r"[\s,;]+", str(value))
+    return [item.strip() for item in items if item and item.strip()]
+
+
+def _display_name(url):
+    """生成用于日志和诊断的代理名称（去除账号密码）"""
+    if url is None:
+        return DIRECT_NAME
+    parts = urlsplit(url)
+    host = parts.hostname or url
+    if parts.port:
+        host = f"{host}:{parts.port}"
+    return f"{parts.scheme}://{host}"
+
+
+def describe_error(error):
+    """生成可写入日志、诊断和追踪的错误描述：异常类型 + 去除查询参数的消息
+
+    requests 的异常消息包含完整请求URL，其中的查询参数带有 Secret 或 Token。
+    """
+    return f"{type(error).__name__}: {_QUERY.sub('?…', str(error))}"
+
+
+class ProxyEndpoint:
+    """代理池中的单个出口（代理或直连）"""
+
+    def __init__(self, url):
+        self.url = url
+        self.name = _display_name(url)
+        self.healthy = True
+        self.latency = None
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.last_error = None
+        self.last_check = None
+        self.total_requests = 0
+        self.total_failures = 0
+
+    @property
+    def proxies(self):
+        """返回 requests 使用的代理字典"""
+        if self.url is None:
+            return None
+        return {"http": self.url, "https": self.url}
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "healthy": self.healthy,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "failures": self.failures,
+            "ejected_for": max(0, round(self.ejected_until - time.time(), 1)),
+            "total_requests": self.total_requests,
+            "total_failures": self.total_failures,
+            "last_error": self.last_error,
+            "last_check": self.last_check,
+        }
+
+
+class ProxyPool:
+    """多代理池：健康检查、延迟移动平均与故障切换"""
+
+    def __init__(self, proxy_urls, direct_fallback=False, previous=None):
+        self._lock = threading.Lock()
+        self.endpoints = []
+        # 热更新时沿用旧代理池中相同出口的延迟和健康状态
+        known = {e.url: e for e in previous.endpoints} if previous else {}
+        for url in proxy_urls:
+            if url.startswith(("http://", "https://")):
+                self.endpoints.append(known.get(url) or ProxyEndpoint(url))
+                _LOGGER.info("已配置HTTP代理: %s", _display_name(url))
+            else:
+                _LOGGER.warning("代理URL格式无效，将不使用该代理: %s", _display_name(url))
+        # 未配置代理时直连；配置了代理时按需追加直连作为兜底
+        if not self.endpoints or direct_fallback:
+            self.endpoints.append(known.get(None) or ProxyEndpoint(None))
+
+    @property
+    def has_proxy(self):
+        return any(endpoint.url for endpoint in self.endpoints)
+
+    def candidates(self):
+        """按优先级返回可用出口：健康的按延迟升序，其次是被剔除的按恢复时间排序"""
+        now = time.time()
+        with self._lock:
+            healthy = [
+                e for e in self.endpoints
+                if e.healthy or e.ejected_until <= now
+            ]
+            ejected = [e for e in self.endpoints if e not in healthy]
+        # 尚无延迟数据的出口视为最快，确保至少被尝试一次
+        healthy.sort(key=lambda e: e.latency if e.latency is not None else 0.0)
+        ejected.sort(key=lambda e: e.ejected_until)
+        return healthy + ejected
+
+    def report_success(self, endpoint, latency):
+        with self._lock:
+            endpoint.total_requests += 1
+            if endpoint.latency is None:
+                endpoint.latency = latency
+            else:
+                endpoint.latency = (
+                    LATENCY_ALPHA * latency + (1 - LATENCY_ALPHA) * endpoint.latency
+                )
+            if not endpoint.healthy:
+                _LOGGER.info("代理已恢复: %s", endpoint.name)
+            endpoint.healthy = True
+            endpoint.failures = 0
+            endpoint.ejected_until = 0.0
+            endpoint.last_error = None
+
+    def report_failure(self, endpoint, error):
+        with self._lock:
+            endpoint.total_requests += 1
+            endpoint.total_failures += 1
+            endpoint.failures += 1
+            endpoint.last_error = describe_error(error)
+            backoff = min(
+                EJECT_MAX_SECONDS, EJECT_BASE_SECONDS * 2 ** (endpoint.failures - 1)
+            )
+            endpoint.ejected_until = time.time() + backoff
+            if endpoint.healthy:
+                _LOGGER.warning("代理不可用，暂时剔除 %s 秒: %s (%s)",
+                                backoff, endpoint.name, endpoint.last_error)
+            endpoint.healthy = False
+
+    def probe(self, endpoint, session, url, timeout):
+        """主动健康检查单个出口（在线程池中执行）"""
+        start = time.monotonic()
+        try:
+            response = session.get(url, proxies=endpoint.proxies, timeout=timeout)
+            response.raise_for_status()
+        except Exception as e:
+            # 任何异常都视为探测失败
+            self.report_failure(endpoint, e)
+        else:
+            self.report_success(endpoint, time.monotonic() - start)
+        endpoint.last_check = time.strftime("%Y-%m-%d %H:%M:%S")
+
+    def as_dict(self):
+        with self._lock:
+            return [endpoint.as_dict() for endpoint in self.endpoints]
@@ -0,0 +1,154 @@
+import time
+import asyncio
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+# 优先级通道：普通和低优先级通道需要为更高优先级保留的令牌比例
+LANE_RESERVES = {
+    "critical": 0.0,
+    "normal": 0.2,
+    "low": 0.5,
+}
+DEFAULT_LANE = "normal"
+
+# 触发限流后速率下降的倍数与下限（相对于默认速率）
+THROTTLE_FACTOR = 0.5
+MIN_RATE_RATIO = 0.1
+# 每次成功发送后速率恢复的比例（相对于默认速率）
+RECOVER_RATIO = 0.05
+# 空闲的接收人令牌桶在超过该时间后被清理（秒）
+IDLE_BUCKET_SECONDS = 600
+
+
+class TokenBucket:
+    """令牌桶：rate 为每秒补充的令牌数，capacity 为突发容量"""
+
+    def __init__(self, per_minute, burst):
+        self.base_rate = per_minute / 60
+        self.rate = self.base_rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, lane=DEFAULT_LANE):
+        """返回该通道获取一个令牌需要等待的秒数"""
+        self._refill()
+        needed = 1 + self.capacity * LANE_RESERVES[lane] - self.tokens
+        if needed <= 0:
+            return 0.0
+        return needed / self.rate
+
+    def consume(self):
+        self._refill()
+        self.tokens -= 1
+
+    def throttle(self):
+        """收到限流错误码时收紧速率并清空令牌"""
+        self._refill()
+        self.rate = max(self.base_rate * MIN_RATE_RATIO, self.rate * THROTTLE_FACTOR)
+        self.tokens = min(self.tokens, 0.0)
+
+    def recover(self):
+        """发送成功后逐步恢复速率"""
+        if self.rate < self.base_rate:
+            self.rate = min(self.base_rate, self.rate + self.base_rate * RECOVER_RATIO)
+
+    @property
+    def idle(self):
+        self._refill()
+        return self.tokens >= self.capacity and self.rate >= self.base_rate
+
+    def as_dict(self):
+        self._refill()
+        return {
+            "tokens": round(self.tokens, 2),
+            "capacity": self.capacity,
+            "rate_per_minute": round(self.rate * 60, 2),
+            "base_rate_per_minute": round(self.base_rate * 60, 2),
+        }
+
+
+class AdaptiveRateLimiter:
+    """按应用和接收人限流的自适应限流器，支持优先级通道"""
+
+    def __init__(self, limits):
+        # limits: {接口: (每分钟次数, 突发容量)}，"recipient" 为单个接收人的限额
+        self._limits = limits
+        self._buckets = {
+            api: TokenBucket(*limit)
+            for api, limit in limits.items() if api != "recipient"
+        }
+        self._recipients = {}
+        self._last_prune = time.monotonic()
+
+    def _recipient_bucket(self, user):
+        bucket = self._recipients.get(user)
+        if bucket is None:
+            bucket = self._recipients[user] = TokenBucket(*self._limits["recipient"])
+        return bucket
+
+    def _buckets_for(self, api, recipients):
+        buckets = [self._buckets[api]]
+        if recipients:
+            buckets.extend(self._recipient_bucket(user) for user in recipients)
+        return buckets
+
+    def _prune(self):
+        now = time.monotonic()
+        if now - self._last_prune < IDLE_BUCKET_SECONDS:
+            return
+        self._last_prune = now
+        for user in [u for u, b in self._recipients.items() if b.idle]:
+            self._recipients.pop(user)
+
+    def wait_time(self, api, recipients=None, lane=DEFAULT_LANE):
+        """当前通道获取令牌需要等待的秒数"""
+        return max(b.wait_time(lane) for b in self._buckets_for(api, recipients))
+
+    async def acquire(self, api, recipients=None, lane=DEFAULT_LANE):
+        """等待直到所有相关令牌桶都有可用令牌，返回累计等待秒数"""
+        if lane not in LANE_RESERVES:
+            lane = DEFAULT_LANE
+        self._prune()
+        buckets = self._buckets_for(api, recipients)
+        waited = 0.0
+        while True:
+            wait = max(b.wait_time(lane) for b in buckets)
+            if wait <= 0:
+                for bucket in buckets:
+                    bucket.consume()
+                if waited:
+                    _LOGGER.debug("限流等待 %.2f 秒 (接口: %s, 通道: %s)", waited, api, lane)
+                return waited
+            await asyncio.sleep(wait)
+            waited += wait
+
+    def throttle(self, api, recipients=None):
+        for bucket in self._buckets_for(api, recipients):
+            bucket.throttle()
+
+    def recover(self, api, recipients=None):
+        for bucket in self._buckets_for(api, recipients):
+            bucket.recover()
+
+    def lane_waits(self, api="message"):
+        """每个优先级通道当前的等待时间（秒）"""
+        return {
+            lane: round(self._buckets[api].wait_time(lane), 2)
+            for lane in LANE_RESERVES
+        }
+
+    def as_dict(self):
+        return {
+            "buckets": {api: b.as_dict() for api, b in self._buckets.items()},
+            "lane_waits": self.lane_waits(),
+            "recipients": {
+                user: b.as_dict() for user, b in self._recipients.items()
+            },
+        }
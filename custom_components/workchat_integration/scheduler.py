@@ -0,0 +1,217 @@
+import logging
+import math
+from datetime import datetime, time, timedelta
+import voluptuous as vol
+from homeassistant.core import callback
+from homeassistant.helpers import config_validation as cv
+from homeassistant.helpers.event import async_track_point_in_utc_time
+from homeassistant.helpers.storage import Store
+from homeassistant.util import dt as dt_util
+from .const import DOMAIN, SCHEDULE_SLOT_SECONDS, MERGE_MAX_BYTES, TRANSPORT_APP
+from .dedup import ROUTING_FIELDS
+
+_LOGGER = logging.getLogger(__name__)
+
+STORAGE_VERSION = 1
+# 合并写入存储的延迟（秒）
+SAVE_DELAY = 1
+# 可以合并为一条消息的类型，其余类型到期后逐条发送
+MERGEABLE_TYPES = ("text", "markdown")
+# 只有这些字段都相同的消息才会合并，合并后的消息沿用这些字段（保密、服务端去重、@成员）
+MERGE_KEY_FIELDS = ROUTING_FIELDS + (
+    "safe", "enable_duplicate_check", "duplicate_check_interval",
+    "mentioned_list", "mentioned_mobile_list",
+)
+
+
+def _quiet_hours(value):
+    """解析免打扰时段，如 "22:00-07:00"，返回 (开始, 结束)"""
+    if isinstance(value, (list, tuple)) and len(value) == 2:
+        start, end = value
+    else:
+        try:
+            start, end = str(value).split("-")
+        except ValueError:
+            raise vol.Invalid(f"免打扰时段格式应为 HH:MM-HH:MM: {value}")
+    return cv.time(start), cv.time(end)
+
+
+# notify 服务的定时发送字段
+SCHEDULE_SCHEMA = vol.Schema({
+    vol.Optional("send_at"): vol.Any(cv.time, cv.datetime),
+    vol.Optional("quiet_hours"): _quiet_hours,
+}, extra=vol.ALLOW_EXTRA)
+
+
+def quiet_hours_end(moment, start, end):
+    """moment 处于免打扰时段内时返回时段结束时间，否则返回 None"""
+    now = moment.time()
+    if start <= end:
+        inside = start <= now < end
+    else:
+        # 跨午夜的时段，如 22:00-07:00
+        inside = now >= start or now < end
+    if not inside:
+        return None
+    release = moment.replace(hour=end.hour, minute=end.minute, second=0, microsecond=0)
+    if release <= moment:
+        release += timedelta(days=1)
+    return release
+
+
+def release_time(send_at=None, quiet_hours=None, priority=None):
+    """计算消息的发送时间；应立即发送时返回 None
+
+    send_at 为时间时取下一次到达该时间；critical 消息不受免打扰时段限制。
+    """
+    now = dt_util.now()
+    release = None
+    if isinstance(send_at, datetime):
+        release = send_at if send_at.tzinfo else send_at.replace(tzinfo=dt_util.DEFAULT_TIME_ZONE)
+        release = dt_util.as_local(release)
+    elif isinstance(send_at, time):
+        release = now.replace(
+            hour=send_at.hour, minute=send_at.minute, second=send_at.second, microsecond=0
+        )
+        if release <= now:
+            release += timedelta(days=1)
+    if quiet_hours and priority != "critical":
+        release = quiet_hours_end(release or now, *_quiet_hours(quiet_hours)) or release
+    if release is None or release <= now:
+        return None
+    return release
+
+
+def _truncate(text, limit):
+    encoded = text.encode()
+    if len(encoded) <= limit:
+        return text
+    return encoded[:limit - 3].decode(errors="ignore") + "..."
+
+
+def merge_messages(messages, default_transport=TRANSPORT_APP):
+    """按接收人和消息选项合并同一批到期的消息：文本与 markdown 合并为一条（超出长度时拆分），其余类型原样发送
+
+    长度上限按消息的发送通道确定，未指定通道时使用条目的默认通道。
+    """
+    groups = {}
+    result = []
+    for data in messages:
+        if data.get("msg_type", "text") not in MERGEABLE_TYPES:
+            result.append(data)
+            continue
+        key = tuple(str(data.get(field, "")) for field in MERGE_KEY_FIELDS)
+        groups.setdefault(key, []).append(data)
+
+    for group in groups.values():
+        if len(group) == 1:
+            result.append(group[0])
+            continue
+        msg_type = "markdown" if any(d.get("msg_type") == "markdown" for d in group) else "text"
+        transport = group[0].get("transport") or default_transport
+        limit = MERGE_MAX_BYTES.get(transport, MERGE_MAX_BYTES[TRANSPORT_APP])[msg_type]
+        routing = {k: v for k, v in group[0].items() if k in MERGE_KEY_FIELDS}
+        parts = [_truncate(str(d.get("message", "")), limit) for d in group]
+        chunk = []
+        for part in parts:
+            candidate = "\n\n".join(chunk + [part])
+            if chunk and len(candidate.encode()) > limit:
+                result.append({**routing, "msg_type": msg_type, "message": "\n\n".join(chunk)})
+                chunk = []
+            chunk.append(part)
+        result.append({**routing, "msg_type": msg_type, "message": "\n\n".join(chunk)})
+    return result
+
+
+class NotifyScheduler:
+    """定时与免打扰消息的时间轮：按分钟分槽并持久化，只为最近到期的槽保留一个定时器"""
+
+    def __init__(self, hass, agent_id, send, default_transport):
+        self.hass = hass
+        self._store = Store(hass, STORAGE_VERSION, f"{DOMAIN}.schedule.{agent_id}")
+        # send(data) 为实际发送消息的协程函数
+        self._send = send
+        # default_transport() 返回条目当前的默认发送通道（选项可热更新）
+        self._default_transport = default_transport
+        # 槽的到期时间戳 -> 消息列表
+        self._slots = {}
+        self._unsub = None
+        self._armed_slot = None
+        self.total_scheduled = 0
+        self.total_released = 0
+        self.total_sends = 0
+
+    async def async_load(self):
+        stored = await self._store.async_load() or {}
+        self._slots = {int(slot): messages for slot, messages in stored.items()}
+        self._arm()
+
+    def _save(self):
+        self._store.async_delay_save(
+            lambda: {str(slot): messages for slot, messages in self._slots.items()}, SAVE_DELAY
+        )
+
+    def schedule(self, data, release):
+        """登记一条消息，在 release 之后的第一个槽到期时发送"""
+        slot = math.ceil(release.timestamp() / SCHEDULE_SLOT_SECONDS) * SCHEDULE_SLOT_SECONDS
+        self._slots.setdefault(slot, []).append(data)
+        self.total_scheduled += 1
+        self._save()
+        self._arm()
+        _LOGGER.debug("消息已延迟到 %s 发送", dt_util.as_local(dt_util.utc_from_timestamp(slot)))
+
+    def _arm(self):
+        """为最近到期的槽设置定时器"""
+        slot = min(self._slots) if self._slots else None
+        if slot == self._armed_slot:
+            return
+        self.cancel()
+        if slot is not None:
+            self._armed_slot = slot
+            self._unsub = async_track_point_in_utc_time(
+                self.hass, self._release, dt_util.utc_from_timestamp(slot)
+            )
+
+    @callback
+    def _release(self, now):
+        self._unsub = None
+        self._armed_slot = None
+        cutoff = now.timestamp()
+        messages = []
+        for slot in sorted(self._slots):
+            if slot > cutoff:
+                break
+            messages.extend(self._slots.pop(slot))
+        self._save()
+        self._arm()
+        if messages:
+            self.hass.async_create_task(self._send_all(messages))
+
+    async def _send_all(self, messages):
+        merged = merge_messages(messages, self._default_transport())
+        self.total_released += len(messages)
+        self.total_sends += len(merged)
+        _LOGGER.info("发送 %s 条延迟消息（合并为 %s 条）", len(messages), len(merged))
+        for data in merged:
+            try:
+                await self._send(data)
+            except Exception as e:
+                _LOGGER.error("发送延迟消息失败: %s", str(e))
+
+    def cancel(self):
+        if self._unsub:
+            self._unsub()
+            self._unsub = None
+        self._armed_slot = None
+
+    def as_dict(self):
+        return {
+            "pending": sum(len(messages) for messages in self._slots.values()),
+            "next_release": (
+                dt_util.utc_from_timestamp(min(self._slots)).isoformat()
+                if self._slots else None
+            ),
+            "total_scheduled": self.total_scheduled,
+            "total_released": self.total_released,
+            "total_sends": self.total_sends,
+        }
@@ -38,6 +38,12 @@ ENTITY_DESCRIPTIONS = {
         name="企微通自定义菜单触发信息",
         icon="mdi:menu",
     ),
+    "rate_limit": SensorEntityDescription(
+        key="rate_limit",
+        name="企微通发送限流等待",
+        icon="mdi:timer-sand",
+        native_unit_of_measurement="s",
+    ),
 }
 
 class WeComBaseEntity(SensorEntity):
@@ -276,6 +282,32 @@ class WorkChatMenuClickSensor(WeComBaseEntity):
         }
         return new_attrs
 
+class WorkChatRateLimitSensor(SensorEntity):
+    """企微通发送限流等待时间实体（普通通道），属性为各优先级通道的等待时间"""
+    
+    _attr_has_entity_name = True
+    _attr_should_poll = True
+    
+    def __init__(self, client, entry):
+        self._client = client
+        self._entry = entry
+        self.entity_description = ENTITY_DESCRIPTIONS["rate_limit"]
+        self._attr_unique_id = f"{entry.entry_id}-rate_limit"
+    
+    @property
+    def native_value(self):
+        return self._client.rate_limiter.lane_waits()["normal"]
+    
+    @property
+    def extra_state_attributes(self):
+        """返回各通道等待时间与当前速率"""
+        buckets = self._client.rate_limiter.as_dict()["buckets"]
+        return {
+            "lane_waits": self._client.rate_limiter.lane_waits(),
+            "message_rate_per_minute": buckets["message"]["rate_per_minute"],
+            "upload_rate_per_minute": buckets["upload"]["rate_per_minute"],
+        }
+
 async def async_setup_entry(hass, entry, async_add_entities):
     """设置所有企微通消息实体"""
     client = hass.data[DOMAIN][entry.entry_id]
@@ -285,6 +317,7 @@ async def async_setup_entry(hass, entry, async_add_entities):
         WorkChatLocationSensor(client, entry),
         WorkChatCallbackInfoSensor(client, entry),
         WorkChatMediaUploadSensor(client, entry),
-        WorkChatMenuClickSensor(client, entry)  # 新增菜单点击实体
+        WorkChatMenuClickSensor(client, entry),  # 新增菜单点击实体
+        WorkChatRateLimitSensor(client, entry)
     ]
     async_add_entities(entities)
@@ -0,0 +1,160 @@
+import os
+import json
+import hashlib
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from homeassistant.util import dt as dt_util
+from .proxy_pool import describe_error
+from .const import (
+    TRACE_FILE, TRACE_SAMPLE_RATE, TRACE_SLOW_MS, TRACE_MAX_BYTES, TRACE_BACKUP_COUNT,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+# 记录回调起始时间的最大条数，用于计算回调到发送的端到端耗时
+_MAX_ORIGINS = 256
+
+
+def new_trace_id():
+    return uuid.uuid4().hex[:16]
+
+
+def maybe_span(trace, name, **attrs):
+    """trace 为空时不计时"""
+    if trace is None:
+        return nullcontext(attrs)
+    return trace.span(name, **attrs)
+
+
+class Trace:
+    """一次请求的追踪记录：同一个 trace_id 贯穿回调、事件、自动化、通知和发送"""
+
+    def __init__(self, kind, trace_id=None):
+        self.trace_id = trace_id or new_trace_id()
+        self.kind = kind
+        self.started = dt_util.utcnow().isoformat()
+        self._start = time.perf_counter()
+        self.spans = []
+        self.attrs = {}
+        self.error = None
+        self.duration_ms = None
+
+    def add_span(self, name, start, end, **attrs):
+        self.spans.append({
+            "name": name,
+            "start_ms": round((start - self._start) * 1000, 2),
+            "duration_ms": round((end - start) * 1000, 2),
+            **attrs,
+        })
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """计时片段；可在事件循环或线程池中使用"""
+        start = time.perf_counter()
+        try:
+            yield attrs
+        except Exception as e:
+            # 只记录异常类型和去除查询参数的消息，避免 Token 写入追踪文件
+            attrs["error"] = describe_error(e)
+            raise
+        finally:
+            self.add_span(name, start, time.perf_counter(), **attrs)
+
+    def finish(self):
+        self.duration_ms = round((time.perf_counter() - self._start) * 1000, 2)
+
+    def as_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "kind": self.kind,
+            "started": self.started,
+            "duration_ms": self.duration_ms,
+            "error": self.error,
+            **self.attrs,
+            "spans": self.spans,
+        }
+
+
+class Tracer:
+    """轻量追踪：按采样率（慢请求和出错的请求总是保留）写入滚动 JSONL 文件"""
+
+    def __init__(self, hass):
+        self.hass = hass
+        self.path = hass.config.path(TRACE_FILE)
+        self._origins = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self, kind, trace_id=None):
+        trace = Trace(kind, trace_id)
+        if kind == "callback":
+            self._origins[trace.trace_id] = time.perf_counter()
+            while len(self._origins) > _MAX_ORIGINS:
+                self._origins.popitem(last=False)
+        else:
+            origin = self._origins.get(trace.trace_id)
+            if origin is not None:
+                # 从收到回调到本次通知开始的耗时（事件分发 + 自动化执行）
+                trace.attrs["since_callback_ms"] = round(
+                    (time.perf_counter() - origin) * 1000, 2
+                )
+        return trace
+
+    def finish(self, trace):
+        trace.finish()
+        # 按 trace_id 的哈希确定性采样，同一条链路的回调与通知记录同时保留；
+        # notify 传入的 trace_id 可以是任意文本
+        digest = hashlib.sha1(str(trace.trace_id).encode()).hexdigest()
+        sampled = (
+            int(digest[:8], 16) / 0xFFFFFFFF < TRACE_SAMPLE_RATE
+            or trace.error is not None
+            or trace.duration_ms >= TRACE_SLOW_MS
+        )
+        if sampled:
+            self.hass.async_add_executor_job(self._write, trace.as_dict())
+
+    def _write(self, record):
+        """追加写入 JSONL，超过大小上限时滚动（在线程池中执行）"""
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            try:
+                if os.path.exists(self.path) and os.path.getsize(self.path) >= TRACE_MAX_BYTES:
+                    self._rotate()
+                with open(self.path, "a", encoding="utf-8") as file:
+                    file.write(line)
+            except OSError as e:
+                _LOGGER.warning("写入追踪文件失败: %s", str(e))
+
+    def _rotate(self):
+        for index in range(TRACE_BACKUP_COUNT - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def read(self, limit=100, trace_id=None):
+        """读取最近的追踪记录，可按 trace_id 过滤（在线程池中执行）"""
+        records = []
+        paths = [self.path] + [
+            f"{self.path}.{index}" for index in range(1, TRACE_BACKUP_COUNT + 1)
+        ]
+        with self._lock:
+            for path in paths:
+                if not os.path.exists(path):
+                    continue
+                with open(path, encoding="utf-8") as file:
+                    lines = file.readlines()
+                for line in reversed(lines):
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if trace_id and record.get("trace_id") != trace_id:
+                        continue
+                    records.append(record)
+                    if len(records) >= limit:
+                        return records
+        return records
@@ -1,17 +1,98 @@
+import io
 import os
 import logging
 import requests
 import hashlib
+import voluptuous as vol
 import time
+import asyncio
+from collections import Counter, deque
+from functools import partial
 import xml.etree.ElementTree as ET
+from datetime import timedelta
 from homeassistant.util import dt as dt_util
 from homeassistant.components.http import HomeAssistantView
+from homeassistant.components import camera
+from homeassistant.core import SupportsResponse
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers import config_validation as cv
+from homeassistant.helpers.event import async_track_time_interval, async_call_later
 from aiohttp import web
-from .const import DOMAIN, API_BASE, CONF_EXTERNAL_URL, CONF_PROXY
+from urllib3.exceptions import NewConnectionError
+from .const import (
+    DOMAIN, API_BASE, CONF_EXTERNAL_URL, CONF_PROXY, CONF_PROXY_DIRECT_FALLBACK,
+    CONF_CONNECT_TIMEOUT, CONF_REQUEST_TIMEOUT, DATA_CALLBACK_VIEW,
+    DEFAULT_CONNECT_TIMEOUT, DEFAULT_REQUEST_TIMEOUT, PROXY_PROBE_INTERVAL, TOKEN_INVALID_ERRCODES,
+    RATE_LIMITS, RATE_LIMIT_ERRCODES, RATE_LIMIT_RETRY_DELAY, RATE_LIMIT_MAX_RETRIES,
+    DEDUP_DEFAULT_WINDOW, CONF_WEBHOOK_KEY, CONF_DEFAULT_TRANSPORT,
+    TRANSPORT_APP, TRANSPORT_WEBHOOK, WEBHOOK_IMAGE_MAX_SIZE,
+    MEDIA_MAX_SIZE, SNAPSHOT_DEFAULT_QUALITY,
+)
+from .dedup import AlertDeduplicator
+from .scheduler import NotifyScheduler, SCHEDULE_SCHEMA, release_time
+from .message_builders import (
+    APP_MESSAGES, APPCHAT_MESSAGES, WEBHOOK_MESSAGES, NOTIFY_SCHEMA, message_options,
+)
+from .cards import TemplateCardStore
+from .appchats import AppChatStore
+from .command_router import CommandRouter
+from .tracing import Tracer, maybe_span
+from .callback_intake import IntakeRejected, check_request, read_body, extract_encrypt
+from .corp_registry import get_corp_registry
 from .encrypt_helper import EncryptHelper  # 确保这行存在
+from .proxy_pool import ProxyPool, describe_error, parse_proxy_list
+from .rate_limiter import AdaptiveRateLimiter
 
 _LOGGER = logging.getLogger(__name__)
 
+# 摄像头快照服务参数；消息类型固定为图片，调用方传入的图片相关字段被忽略
+SNAPSHOT_SCHEMA = vol.Schema({
+    vol.Required("camera"): cv.entity_domain("camera"),
+    vol.Optional("quality"): vol.All(vol.Coerce(int), vol.Range(min=1, max=95)),
+    vol.Optional("max_width"): cv.positive_int,
+    vol.Remove("msg_type"): object,
+    vol.Remove("media_id"): object,
+    vol.Remove("image_bytes"): object,
+}, extra=vol.ALLOW_EXTRA)
+
+def _recompress_image(content, quality, max_width=None):
+    """按需缩放并重新压缩为JPEG（在线程池中执行）"""
+    from PIL import Image
+    
+    with Image.open(io.BytesIO(content)) as image:
+        image = image.convert("RGB")
+        if max_width and image.width > max_width:
+            height = round(image.height * max_width / image.width)
+            image = image.resize((max_width, height))
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=quality, optimize=True)
+    return output.getvalue()
+
+def _select_client(hass, agent_id=None, chatid=None):
+    """共用服务选择条目：指定 agent_id 时使用该应用的条目；
+    指定 chatid 时使用缓存了该群聊的条目；否则使用最早加载的条目"""
+    clients = list(hass.data.get(DOMAIN, {}).values())
+    if agent_id is not None:
+        clients = [c for c in clients if str(c.config["agent_id"]) == str(agent_id)]
+    elif chatid:
+        # 群聊按应用保存，优先使用创建了该群聊的条目
+        clients = [c for c in clients if c.appchats.get(chatid)] + clients
+    return clients[0] if clients else None
+
+def _select_client_or_raise(hass, agent_id=None, chatid=None):
+    client = _select_client(hass, agent_id, chatid)
+    if client is None:
+        raise HomeAssistantError(f"未找到应用: {agent_id}")
+    return client
+
+def _is_connect_error(error):
+    """连接阶段的失败（请求尚未发出），切换出口重试不会重复发送"""
+    if isinstance(error, (requests.exceptions.ConnectTimeout, requests.exceptions.ProxyError)):
+        return True
+    # 连接失败时 requests 包装的是 MaxRetryError，其 reason 为 urllib3 的原始异常
+    reason = error.args[0] if error.args else None
+    return isinstance(getattr(reason, "reason", reason), NewConnectionError)
+
 class WorkChatCallbackView(HomeAssistantView):
     """处理企微通回调的视图"""
     
@@ -19,8 +100,17 @@ class WorkChatCallbackView(HomeAssistantView):
     name = "api:workchat_callback"
     requires_auth = False
     
-    def __init__(self, client):
-        self.client = client
+    def __init__(self, hass):
+        self.hass = hass
+        # 无法对应到任何配置条目的请求（Token不匹配）
+        self.rejections = Counter()
+    
+    def _find_client(self, token):
+        """按URL中的Token查找客户端；条目重新加载后自动指向新的客户端"""
+        for client in self.hass.data.get(DOMAIN, {}).values():
+            if client.config["token"] == token:
+                return client
+        return None
     
     def _calculate_signature(self, token, timestamp, nonce, encrypt):
         token = str(token)
@@ -47,13 +137,13 @@ class WorkChatCallbackView(HomeAssistantView):
         _LOGGER.debug("验证回调请求 - Token: %s, 时间戳: %s, 随机数: %s, 加密字符串: %s, 签名: %s", 
                      token, timestamp, nonce, echostr, signature)
         
-        if token != self.client.config["token"]:
-            _LOGGER.error("Token不匹配! URL中的Token: %s, 配置Token: %s", 
-                         token, self.client.config["token"])
+        client = self._find_client(token)
+        if client is None:
+            _LOGGER.error("Token不匹配! URL中的Token: %s", token)
             return web.Response(text="Token不匹配", status=400)
         
         calc_sign = self._calculate_signature(
-            self.client.config["token"], timestamp, nonce, echostr
+            client.config["token"], timestamp, nonce, echostr
         )
         _LOGGER.debug("计算签名: %s", calc_sign)
         
@@ -62,73 +152,218 @@ class WorkChatCallbackView(HomeAssistantView):
             return web.Response(text="签名验证失败", status=400)
         
         try:
-            decrypted = self.client.encryptor.Decrypt(echostr)
+            decrypted = client.encryptor.Decrypt(echostr)
             _LOGGER.debug("验证成功, 解密内容: %s", decrypted)
             return web.Response(text=decrypted)
         except Exception as e:
+            # 不向调用方返回异常细节
             _LOGGER.error("解密失败: %s", str(e))
-            return web.Response(text=f"解密失败: {str(e)}", status=400)
+            return web.Response(text="解密失败", status=400)
     
     async def post(self, request, token):
         _LOGGER.debug("收到回调消息 - Token: %s, 方法: POST", token)
         
+        # 读取请求体之前先做廉价检查，尽早拒绝无效请求
+        client = self._find_client(token)
+        if client is None:
+            self.rejections["bad_token"] += 1
+            return web.Response(text="bad_token", status=400)
+        try:
+            check_request(request)
+        except IntakeRejected as e:
+            return self._reject(client, e)
+        
+        # 回调时生成 trace_id，随事件数据传递到自动化和通知服务
+        trace = client.tracer.start("callback")
         try:
-            data = await request.text()
-            root = ET.fromstring(data)
-            encrypt = root.find('Encrypt').text
+            with trace.span("read_body"):
+                body = await read_body(request)
+                encrypt = extract_encrypt(body)
             
-            response = await self.client.handle_callback({
+            response = await client.handle_callback({
                 "msg_signature": request.query.get("msg_signature", ""),
                 "timestamp": request.query.get("timestamp", ""),
                 "nonce": request.query.get("nonce", ""),
                 "encrypt": encrypt
-            })
+            }, trace=trace)
             
             if isinstance(response, tuple):
+                trace.error = response[0]
                 return web.Response(text=response[0], status=response[1])
             return web.Response(text=response, content_type="application/xml")
+        except IntakeRejected as e:
+            trace.error = e.reason
+            return self._reject(client, e)
         except Exception as e:
+            trace.error = describe_error(e)
             _LOGGER.exception("处理回调时发生异常: %s", str(e))
-            return web.Response(text=f"服务器错误: {str(e)}", status=500)
+            return web.Response(text="服务器错误", status=500)
+        finally:
+            client.tracer.finish(trace)
+    
+    def _reject(self, client, error):
+        """按原因计数并拒绝请求"""
+        client.count_rejection(error.reason)
+        return web.Response(text=error.reason, status=error.status)
 
 class WorkChatClient:
     def __init__(self, hass, config):
         self.hass = hass
         self.config = config
-        self.access_token = None
-        self.token_expire = 0
+        # 同一企业的多个应用共享Token缓存和发送池
+        self.corp_registry = get_corp_registry(hass)
+        self._token = None
+        self._send_times = deque()
+        # 发送与上传的客户端限流（按应用和接收人）
+        self.rate_limiter = AdaptiveRateLimiter(RATE_LIMITS)
+        self._retry_unsubs = set()
+        # 告警风暴去重与摘要合并
+        self.deduplicator = AlertDeduplicator(hass, self._route_and_send)
+        # 定时与免打扰时段延迟发送的消息
+        self.scheduler = NotifyScheduler(
+            hass, config["agent_id"], self._route_and_send,
+            lambda: self.config.get(CONF_DEFAULT_TRANSPORT, TRANSPORT_APP)
+        )
+        # 模板卡片 card_key -> msgid / response_code
+        self.cards = TemplateCardStore(hass, config["agent_id"])
+        # 群聊会话 chatid -> 成员
+        self.appchats = AppChatStore(hass, config["agent_id"])
+        # 入站命令路由（文本命令与菜单EventKey）
+        self.command_router = CommandRouter(hass)
+        # 成员位置追踪（由 device_tracker 平台设置）
+        self.location_coalescer = None
+        # 请求追踪（回调到发送全链路）
+        self.tracer = Tracer(hass)
+        # 回调请求按原因统计的拒绝次数
+        self.intake_rejections = Counter()
         self.encryptor = EncryptHelper(
             config["aes_key"],
             config["token"]
         )
         self.callback_url = None
         
-        # 初始化代理设置
-        self.proxies = None
-        proxy_url = config.get(CONF_PROXY, "").strip()
-        if proxy_url:
-            # 验证代理URL格式
-            if proxy_url.startswith(("http://", "https://")):
-                self.proxies = {
-                    "http": proxy_url,
-                    "https": proxy_url
-                }
-                _LOGGER.info("已配置HTTP代理: %s", proxy_url)
-            else:
-                _LOGGER.warning("代理URL格式无效，将不使用代理: %s", proxy_url)
+        # 初始化代理池（多代理 + 可选直连兜底），共享同一个连接池
+        self.proxy_pool = ProxyPool(
+            parse_proxy_list(config.get(CONF_PROXY, "")),
+            direct_fallback=config.get(CONF_PROXY_DIRECT_FALLBACK, False)
+        )
+        self.connect_timeout = config.get(CONF_CONNECT_TIMEOUT, DEFAULT_CONNECT_TIMEOUT)
+        self.request_timeout = config.get(CONF_REQUEST_TIMEOUT, DEFAULT_REQUEST_TIMEOUT)
+        self._session = requests.Session()
+        self._unsub_probe = None
+    
+    async def apply_config(self, config):
+        """热更新选项：不重建客户端，保留Token、回调视图和正在进行的发送
+        
+        代理池、默认接收人和超时整体替换；正在执行的请求继续使用旧的代理池。
+        """
+        proxy_pool = ProxyPool(
+            parse_proxy_list(config.get(CONF_PROXY, "")),
+            direct_fallback=config.get(CONF_PROXY_DIRECT_FALLBACK, False),
+            previous=self.proxy_pool,
+        )
+        if self._unsub_probe:
+            self._unsub_probe()
+            self._unsub_probe = None
+        self.config = config
+        self.proxy_pool = proxy_pool
+        self.connect_timeout = config.get(CONF_CONNECT_TIMEOUT, DEFAULT_CONNECT_TIMEOUT)
+        self.request_timeout = config.get(CONF_REQUEST_TIMEOUT, DEFAULT_REQUEST_TIMEOUT)
+        self.callback_url = self._build_callback_url()
+        await self.setup_proxy_health_check()
+        _LOGGER.info("企微通选项已更新，回调URL: %s", self.callback_url)
+    
+    def _request(self, method, url, timeout=None, trace=None, **kwargs):
+        """通过代理池发送请求（在线程池中执行）
+        
+        按延迟选择最快的健康出口；连接阶段失败时剔除该出口并切换到下一个，
+        已发出的请求超时或连接被重置时不会重试，避免重复发送消息。
+        每次出口尝试（连接与完整的请求往返）记录为 proxy_request 片段。
+        """
+        # 整个请求期间使用同一个代理池，不受热更新影响
+        proxy_pool = self.proxy_pool
+        timeout = (self.connect_timeout, timeout or self.request_timeout)
+        last_error = None
+        for endpoint in proxy_pool.candidates():
+            start = time.monotonic()
+            try:
+                with maybe_span(trace, "proxy_request", proxy=endpoint.name):
+                    response = self._session.request(
+                        method, url, proxies=endpoint.proxies,
+                        timeout=timeout, **kwargs
+                    )
+            except requests.exceptions.ConnectionError as e:
+                proxy_pool.report_failure(endpoint, e)
+                if not _is_connect_error(e):
+                    raise
+                _LOGGER.debug("出口 %s 连接失败，尝试下一个: %s", endpoint.name, describe_error(e))
+                last_error = e
+                continue
+            except requests.exceptions.RequestException as e:
+                proxy_pool.report_failure(endpoint, e)
+                raise
+            proxy_pool.report_success(endpoint, time.monotonic() - start)
+            return response
+        raise last_error
+    
+    async def setup_proxy_health_check(self):
+        """启动代理池主动健康检查"""
+        if not self.proxy_pool.has_proxy:
+            return
+        
+        async def _probe_all(now=None):
+            probe_url = f"{API_BASE}/gettoken"
+            timeout = (self.connect_timeout, self.request_timeout)
+            proxy_pool = self.proxy_pool
+            await asyncio.gather(*(
+                self.hass.async_add_executor_job(
+                    proxy_pool.probe, endpoint, self._session, probe_url, timeout
+                )
+                for endpoint in proxy_pool.endpoints
+            ))
+        
+        self._unsub_probe = async_track_time_interval(
+            self.hass, _probe_all, timedelta(seconds=PROXY_PROBE_INTERVAL)
+        )
+        self.hass.async_create_task(_probe_all())
+    
+    def count_rejection(self, reason):
+        self.intake_rejections[reason] += 1
+        _LOGGER.debug("拒绝回调请求: %s（累计 %s 次）", reason, self.intake_rejections[reason])
+    
+    def register(self):
+        """登记到企业注册表，获取共享的Token缓存"""
+        self._token = self.corp_registry.register(self)
+    
+    def unregister(self):
+        self.corp_registry.unregister(self)
+    
+    def recent_send_count(self, window=60):
+        """最近 window 秒内本应用的发送次数"""
+        cutoff = time.monotonic() - window
+        while self._send_times and self._send_times[0] < cutoff:
+            self._send_times.popleft()
+        return len(self._send_times)
     
     async def get_access_token(self):
-        """获取或刷新Access Token（支持代理）"""
-        if self.access_token and time.time() < self.token_expire - 60:
-            return self.access_token
-            
+        """获取或刷新Access Token（支持代理，同一企业同一Secret共享）"""
+        if self._token.valid():
+            return self._token.access_token
+        
+        async with self._token.lock:
+            # 等待锁期间可能已被其他条目刷新
+            if self._token.valid():
+                return self._token.access_token
+            return await self._fetch_access_token()
+    
+    async def _fetch_access_token(self):
         url = f"{API_BASE}/gettoken?corpid={self.config['corp_id']}&corpsecret={self.config['secret']}"
         
-        _LOGGER.debug("获取Access Token，URL: %s, 代理: %s", url, self.proxies)
+        _LOGGER.debug("获取Access Token，URL: %s", url)
         
         def _get_token():
             try:
-                response = requests.get(url, proxies=self.proxies, timeout=10)
+                response = self._request("GET", url)
                 if response.status_code == 200:
                     data = response.json()
                     if data.get("errcode") == 0:
@@ -142,21 +377,20 @@ class WorkChatClient:
             except requests.exceptions.Timeout:
                 _LOGGER.error("获取Access Token请求超时")
             except requests.exceptions.RequestException as e:
-                _LOGGER.error("获取Access Token网络异常: %s", str(e))
+                _LOGGER.error("获取Access Token网络异常: %s", describe_error(e))
             return None
         
         data = await self.hass.async_add_executor_job(_get_token)
         
         if data and data.get("errcode") == 0:
-            self.access_token = data["access_token"]
-            self.token_expire = time.time() + data["expires_in"]
-            return self.access_token
+            self._token.update(data["access_token"], data["expires_in"])
+            return self._token.access_token
         
         _LOGGER.error("获取Access Token失败")
         return None
     
-    async def setup_callback(self):
-        """注册回调URL"""
+    def _build_callback_url(self):
+        """根据外部URL和Token计算回调URL"""
         external_url = self.config[CONF_EXTERNAL_URL]
     
         # 清理external_url，移除可能存在的重复回调路径
@@ -176,27 +410,116 @@ class WorkChatClient:
         if not external_url.endswith('/'):
             external_url += '/'
     
-        callback_url = f"{external_url}api/workchat_callback/{token}"
-        self.callback_url = callback_url
-    
         _LOGGER.info("外部URL已清理: %s", external_url)
-        _LOGGER.info("回调URL已配置: %s", callback_url)
-        _LOGGER.info("代理设置: %s", "已启用" if self.proxies else "未启用")
+        return f"{external_url}api/workchat_callback/{token}"
+    
+    async def setup_callback(self):
+        """注册回调URL"""
+        self.callback_url = self._build_callback_url()
+        _LOGGER.info("回调URL已配置: %s", self.callback_url)
+        _LOGGER.info("代理设置: %s", "已启用" if self.proxy_pool.has_proxy else "未启用")
+    
+        # 视图只注册一次：HA无法注销视图，重复注册时旧视图会继续指向已卸载的客户端
+        if DATA_CALLBACK_VIEW not in self.hass.data:
+            view = self.hass.data[DATA_CALLBACK_VIEW] = WorkChatCallbackView(self.hass)
+            self.hass.http.register_view(view)
     
-        self.hass.http.register_view(WorkChatCallbackView(self))
     async def remove_callback(self):
         """清理回调"""
-        pass
+        if self._unsub_probe:
+            self._unsub_probe()
+            self._unsub_probe = None
+        for unsub in list(self._retry_unsubs):
+            unsub()
+        self._retry_unsubs.clear()
+        # 未到期的延迟消息保留在存储中，重新加载后继续计时
+        self.scheduler.cancel()
+        await self.deduplicator.async_flush_all()
+        await self.hass.async_add_executor_job(self._session.close)
     
     async def setup_notify_service(self):
-        """注册通知服务"""
+        """注册通知服务（所有条目共用一个服务，调用时按 agent_id 选择条目）"""
+        await self.scheduler.async_load()
+        if self.hass.services.has_service(DOMAIN, "notify"):
+            return
+        hass = self.hass
+        
         async def workchat_notify(call):
-            await self.send_message(
-                **call.data
+            client = _select_client_or_raise(
+                hass, call.data.get("agent_id"), call.data.get("chatid")
             )
+            await client.async_notify(dict(call.data))
+        
+        def _validate_message(data):
+            # 按发送通道校验消息参数，无效的调用在获取Token和网络请求之前被拒绝
+            client = _select_client(hass, data.get("agent_id"), data.get("chatid"))
+            if client is None:
+                raise vol.Invalid(f"未找到应用: {data.get('agent_id')}", path=["agent_id"])
+            client._message_registry(data).validate(data)
+            return data
             
         self.hass.services.async_register(
-            DOMAIN, "notify", workchat_notify
+            DOMAIN, "notify", workchat_notify,
+            schema=vol.All(NOTIFY_SCHEMA, SCHEDULE_SCHEMA, _validate_message)
+        )
+    
+    def _message_registry(self, data):
+        transport = data.get("transport") or self.config.get(
+            CONF_DEFAULT_TRANSPORT, TRANSPORT_APP
+        )
+        if transport == TRANSPORT_WEBHOOK:
+            return WEBHOOK_MESSAGES
+        return APPCHAT_MESSAGES if data.get("chatid") else APP_MESSAGES
+    
+    async def async_notify(self, data):
+        """处理通知服务调用：定时与免打扰消息延迟发送，其余告警去重后按应用路由发送"""
+        # 沿用回调事件中的 trace_id，串联回调到发送的耗时
+        trace = self.tracer.start("notify", data.pop("trace_id", None))
+        trace.attrs["msg_type"] = data.get("msg_type", "text")
+        try:
+            dedup_key = data.pop("dedup_key", None)
+            dedup_window = data.pop("dedup_window", DEDUP_DEFAULT_WINDOW)
+            dedup = data.pop("dedup", False) or dedup_key
+            release = release_time(
+                data.pop("send_at", None), data.pop("quiet_hours", None), data.get("priority")
+            )
+            if release is not None:
+                # 延迟的消息到期时按接收人合并发送，不再参与去重
+                self.scheduler.schedule(data, release)
+                trace.attrs["result"] = "scheduled"
+                return True
+            if dedup:
+                if not self.deduplicator.check(data, dedup_key, dedup_window):
+                    trace.attrs["result"] = "suppressed"
+                    return False
+            result = await self._route_and_send(data, trace)
+            trace.attrs["result"] = "sent" if result else "failed"
+            return result
+        except Exception as e:
+            trace.error = describe_error(e)
+            raise
+        finally:
+            self.tracer.finish(trace)
+    
+    async def _route_and_send(self, data, trace=None):
+        """按指定应用或同一企业的应用池发送"""
+        data = dict(data)
+        client = self
+        agent_id = data.pop("agent_id", None)
+        if data.pop("agent_pool", False):
+            client = self.corp_registry.pick_agent(self)
+            if client is not self:
+                # 应用池只改变发送应用，接收人和发送通道仍使用本条目的默认值
+                data.setdefault("transport", self.config.get(CONF_DEFAULT_TRANSPORT, TRANSPORT_APP))
+                if not data.get("chatid"):
+                    data.setdefault("touser", self.config["receive_user"])
+        elif agent_id is not None:
+            client = self.corp_registry.get_agent(self.config["corp_id"], agent_id)
+            if client is None:
+                _LOGGER.error("未找到应用: %s", agent_id)
+                return False
+        return await client.send_message(
+            _trace=trace, **data
         )
     
     async def setup_media_services(self):
@@ -220,43 +543,72 @@ class WorkChatClient:
         self.hass.services.async_register(
             DOMAIN, "upload_media", upload_media
         )
+        
+        async def send_camera_snapshot(call):
+            data = dict(call.data)
+            try:
+                return await self.send_camera_snapshot(
+                    data.pop("camera"),
+                    quality=data.pop("quality", None),
+                    max_width=data.pop("max_width", None),
+                    **data
+                )
+            except HomeAssistantError as e:
+                _LOGGER.error("获取摄像头快照失败: %s", str(e))
+                return {"error": str(e)}
+            except Exception as e:
+                _LOGGER.error("发送摄像头快照失败: %s", str(e))
+                return {"error": str(e)}
+        
+        self.hass.services.async_register(
+            DOMAIN, "send_camera_snapshot", send_camera_snapshot,
+            schema=SNAPSHOT_SCHEMA,
+            supports_response=SupportsResponse.OPTIONAL
+        )
     
     async def upload_media_file(self, media_type, file_path, file_name=None):
         """上传媒体文件到企微通（支持代理）"""
+        def _read():
+            if not os.path.exists(file_path):
+                raise FileNotFoundError(f"文件不存在: {file_path}")
+            return self._read_file(file_path, MEDIA_MAX_SIZE)
+        
+        try:
+            content = await self.hass.async_add_executor_job(_read)
+        except Exception as e:
+            _LOGGER.error("文件上传失败: %s", str(e))
+            raise
+        
+        return await self.upload_media_bytes(
+            media_type, content, file_name or os.path.basename(file_path),
+            file_path=file_path
+        )
+    
+    async def upload_media_bytes(self, media_type, content, filename,
+                                 content_type=None, file_path=None):
+        """直接上传内存中的媒体内容到企微通，无需落盘"""
         access_token = await self.get_access_token()
         if not access_token:
             raise Exception("无法获取Access Token")
         
         url = f"{API_BASE}/media/upload?access_token={access_token}&type={media_type}"
         
-        _LOGGER.debug("上传媒体文件，URL: %s, 代理: %s", url, self.proxies)
+        await self.rate_limiter.acquire("upload")
         
-        def _perform_upload():
-            if not os.path.exists(file_path):
-                raise FileNotFoundError(f"文件不存在: {file_path}")
-            
-            file_size = os.path.getsize(file_path)
-            max_size = 10 * 1024 * 1024  # 10MB
-            if file_size > max_size:
-                raise ValueError(f"文件过大 ({file_size/(1024 * 1024):.2f}MB)，最大支持10MB")
-            
-            filename = file_name or os.path.basename(file_path)
-            
-            with open(file_path, "rb") as file:
-                files = {"media": (filename, file)}
-                response = requests.post(url, files=files, 
-                                       proxies=self.proxies, timeout=30)
-                return response, filename
+        _LOGGER.debug("上传媒体文件，类型: %s, 大小: %s字节", media_type, len(content))
+        
+        if content_type:
+            files = {"media": (filename, content, content_type)}
+        else:
+            files = {"media": (filename, content)}
         
         try:
-            result = await self.hass.async_add_executor_job(_perform_upload)
-            response, filename = result
+            response = await self.hass.async_add_executor_job(
+                partial(self._request, "POST", url, files=files, timeout=30)
+            )
         except requests.exceptions.RequestException as e:
-            _LOGGER.error("文件上传网络异常: %s", str(e))
-            raise Exception(f"网络异常: {str(e)}")
-        except Exception as e:
-            _LOGGER.error("文件上传失败: %s", str(e))
-            raise
+            _LOGGER.error("文件上传网络异常: %s", describe_error(e))
+            raise Exception(f"网络异常: {describe_error(e)}")
         
         if response.status_code != 200:
             error_msg = f"上传失败，HTTP状态码: {response.status_code}"
@@ -287,90 +639,526 @@ class WorkChatClient:
         
         return media_id
     
-    async def send_message(self, **kwargs):
-        """发送消息到企微通（支持代理）"""
-        access_token = await self.get_access_token()
+    async def send_camera_snapshot(self, camera_entity, quality=None, max_width=None, **kwargs):
+        """摄像头快照直接在内存中上传并发送图片消息，返回各阶段耗时"""
+        timings = {}
+        start = time.perf_counter()
+        
+        image = await camera.async_get_image(self.hass, camera_entity)
+        content, content_type = image.content, image.content_type
+        timings["capture_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        
+        if quality or max_width:
+            mark = time.perf_counter()
+            content = await self.hass.async_add_executor_job(
+                _recompress_image, content, quality or SNAPSHOT_DEFAULT_QUALITY, max_width
+            )
+            content_type = "image/jpeg"
+            timings["recompress_ms"] = round((time.perf_counter() - mark) * 1000, 1)
+        
+        filename = f"{camera_entity.split('.', 1)[-1]}_{int(time.time())}.jpg"
+        mark = time.perf_counter()
+        if self._message_registry(kwargs) is WEBHOOK_MESSAGES:
+            # 群机器人图片消息直接使用图片内容，无需上传
+            sent = await self.send_message(
+                msg_type="image", image_bytes=content, **kwargs
+            )
+            timings["send_ms"] = round((time.perf_counter() - mark) * 1000, 1)
+            media_id = None
+        else:
+            media_id = await self.upload_media_bytes(
+                "image", content, filename, content_type
+            )
+            timings["upload_ms"] = round((time.perf_counter() - mark) * 1000, 1)
+            mark = time.perf_counter()
+            sent = await self.send_message(msg_type="image", media_id=media_id, **kwargs)
+            timings["send_ms"] = round((time.perf_counter() - mark) * 1000, 1)
+        timings["total_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        
+        result = {
+            "camera": camera_entity,
+            "sent": sent,
+            "media_id": media_id,
+            "size": len(content),
+            **timings
+        }
+        _LOGGER.info("摄像头快照发送%s，耗时 %sms", "成功" if sent else "失败", timings["total_ms"])
+        self.hass.bus.async_fire("workchat_snapshot_sent", result)
+        return result
+    
+    async def send_message(self, _attempt=0, _trace=None, **kwargs):
+        """发送消息到企微通（支持代理和客户端限流）"""
+        if self._message_registry(kwargs) is WEBHOOK_MESSAGES:
+            return await self.send_webhook_message(_attempt, _trace, **kwargs)
+        if kwargs.get("chatid"):
+            return await self.send_appchat_message(_attempt, _trace, **kwargs)
+        
+        msg_type = kwargs.get("msg_type", "text")
+        payload = {
+            "touser": kwargs.get("touser", self.config["receive_user"]),
+            "agentid": self.config["agent_id"],
+            "msgtype": msg_type,
+            **message_options(kwargs),
+        }
+        
+        card_key = kwargs.get("card_key")
+        data = kwargs
+        if msg_type == "template_card" and card_key:
+            # 企业微信不允许同一应用重复使用 task_id，每次发送生成新的 task_id
+            data = {**kwargs, "task_id": f"{card_key}-{int(time.time() * 1000)}"}
+        
+        # 根据消息类型校验参数并构建payload
+        try:
+            payload[msg_type] = APP_MESSAGES.build(data)
+        except vol.Invalid as e:
+            _LOGGER.error("消息参数错误，缺少或无效字段: %s", str(e))
+            return False
+        
+        previous = self.cards.get(card_key) if msg_type == "template_card" and card_key else None
+        if previous:
+            # 同一张卡片优先原地更新；无可用 response_code 时发送新卡片，成功后再撤回旧卡片
+            if await self.update_template_card(card_key, template_card=kwargs["template_card"]):
+                return True
+        
+        with maybe_span(_trace, "token_fetch"):
+            access_token = await self.get_access_token()
         if not access_token: 
             _LOGGER.error("无法获取有效的Access Token")
             return False
-            
+        
+        _LOGGER.debug("准备发送消息到企微通，类型: %s", msg_type)
+        
+        # 按应用和接收人限流，critical 通道优先于普通消息
+        recipients = [
+            user for user in str(payload["touser"]).split("|")
+            if user and user != "@all"
+        ]
+        url = f"{API_BASE}/message/send?access_token={access_token}"
+        response_data = await self._post_message(
+            "message", url, payload, recipients, kwargs, _attempt, _trace
+        )
+        if response_data is not None and msg_type == "template_card" and card_key:
+            if previous and previous.get("msgid"):
+                await self.recall_message(msgid=previous["msgid"])
+            self.cards.record_send(card_key, payload, response_data)
+        return response_data is not None
+    
+    async def send_appchat_message(self, _attempt=0, _trace=None, **kwargs):
+        """发送消息到群聊会话，一次请求送达全部群成员"""
         msg_type = kwargs.get("msg_type", "text")
         payload = {
-            "touser": kwargs.get("touser", self.config["receive_user"]),
-            "agentid": self.config["agent_id"],
-            "msgtype": msg_type
+            "chatid": kwargs["chatid"],
+            "msgtype": msg_type,
+            "safe": 0,
+            # 群聊消息不支持服务端重复消息检查
+            **message_options(kwargs, ("safe",)),
         }
+        try:
+            payload[msg_type] = APPCHAT_MESSAGES.build(kwargs)
+        except vol.Invalid as e:
+            _LOGGER.error("消息参数错误，缺少或无效字段: %s", str(e))
+            return False
         
-        # 根据消息类型构建payload
-        if msg_type == "text":
-            payload["text"] = {"content": kwargs["message"]}
-        elif msg_type == "image":
-            payload["image"] = {"media_id": kwargs["media_id"]}
-        elif msg_type == "file":
-            payload["file"] = {"media_id": kwargs["media_id"]}
-        elif msg_type == "textcard":
-            payload["textcard"] = {
-                "title": kwargs["title"],
-                "description": kwargs["message"],
-                "url": kwargs["url"],
-                "btntxt": kwargs.get("btntxt", "详情")
-            }
-        elif msg_type == "news":
-            articles = kwargs.get("articles", [])
-            if not articles and kwargs.get("title"):
-                articles = [{
-                    "title": kwargs["title"],
-                    "description": kwargs.get("description", kwargs.get("message", "")),
-                    "url": kwargs.get("url", ""),
-                    "picurl": kwargs.get("picurl", "")
-                }]
-            payload["news"] = {"articles": articles}
-        elif msg_type == "markdown":
-            payload["markdown"] = {"content": kwargs["message"]}
-        elif msg_type == "voice":
-            payload["voice"] = {"media_id": kwargs["media_id"]}
-        elif msg_type == "video":
-            payload["video"] = {
-                "media_id": kwargs["media_id"],
-                "title": kwargs.get("title", ""),
-                "description": kwargs.get("description", "")
+        with maybe_span(_trace, "token_fetch"):
+            access_token = await self.get_access_token()
+        if not access_token:
+            _LOGGER.error("无法获取有效的Access Token")
+            return False
+        
+        _LOGGER.debug("准备发送群聊消息，chatid: %s, 类型: %s", kwargs["chatid"], msg_type)
+        url = f"{API_BASE}/appchat/send?access_token={access_token}"
+        response_data = await self._post_message(
+            "message", url, payload, None, kwargs, _attempt, _trace
+        )
+        return response_data is not None
+    
+    async def create_appchat(self, userlist, name=None, owner=None, chatid=None):
+        """创建群聊会话，返回chatid"""
+        payload = {"userlist": list(userlist)}
+        if name:
+            payload["name"] = name
+        if owner:
+            payload["owner"] = owner
+        if chatid:
+            payload["chatid"] = chatid
+        data = await self._call_api("appchat/create", payload)
+        if data is None:
+            return None
+        chatid = data["chatid"]
+        self.appchats.set(chatid, name, owner, userlist)
+        _LOGGER.info("群聊已创建: %s", chatid)
+        return chatid
+    
+    async def update_appchat(self, chatid, name=None, owner=None,
+                             add_user_list=None, del_user_list=None):
+        """修改群聊会话并同步本地缓存"""
+        payload = {"chatid": chatid}
+        if name:
+            payload["name"] = name
+        if owner:
+            payload["owner"] = owner
+        if add_user_list:
+            payload["add_user_list"] = list(add_user_list)
+        if del_user_list:
+            payload["del_user_list"] = list(del_user_list)
+        if await self._call_api("appchat/update", payload) is None:
+            return False
+        self.appchats.update(chatid, name, owner, add_user_list, del_user_list)
+        return True
+    
+    async def refresh_appchat(self, chatid):
+        """从企业微信获取群聊信息刷新缓存"""
+        access_token = await self.get_access_token()
+        if not access_token:
+            return None
+        url = f"{API_BASE}/appchat/get?access_token={access_token}&chatid={chatid}"
+        try:
+            response = await self.hass.async_add_executor_job(
+                partial(self._request, "GET", url)
+            )
+            data = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            _LOGGER.error("获取群聊 %s 失败: %s", chatid, describe_error(e))
+            return None
+        if data.get("errcode") != 0:
+            _LOGGER.error("获取群聊 %s 失败: %s", chatid, data.get("errmsg"))
+            return None
+        info = data["chat_info"]
+        self.appchats.set(chatid, info.get("name"), info.get("owner"), info.get("userlist", []))
+        return self.appchats.get(chatid)
+    
+    async def setup_appchat_services(self):
+        """注册群聊会话管理服务（所有条目共用，按 agent_id 或群聊所在条目选择）"""
+        await self.appchats.async_load()
+        if self.hass.services.has_service(DOMAIN, "create_appchat"):
+            return
+        hass = self.hass
+        
+        async def create_appchat(call):
+            client = _select_client_or_raise(hass, call.data.get("agent_id"))
+            chatid = await client.create_appchat(
+                call.data["userlist"],
+                name=call.data.get("name"),
+                owner=call.data.get("owner"),
+                chatid=call.data.get("chatid")
+            )
+            return {"chatid": chatid}
+        
+        async def update_appchat(call):
+            client = _select_client_or_raise(hass, call.data.get("agent_id"), call.data["chatid"])
+            await client.update_appchat(
+                call.data["chatid"],
+                name=call.data.get("name"),
+                owner=call.data.get("owner"),
+                add_user_list=call.data.get("add_user_list"),
+                del_user_list=call.data.get("del_user_list")
+            )
+        
+        async def list_appchats(call):
+            # 未指定 agent_id 时列出所有条目的群聊
+            if call.data.get("agent_id") is not None:
+                clients = [_select_client_or_raise(hass, call.data["agent_id"])]
+            else:
+                clients = list(hass.data.get(DOMAIN, {}).values())
+            chats = []
+            for client in clients:
+                if call.data.get("refresh"):
+                    for chat in client.appchats.as_list():
+                        await client.refresh_appchat(chat["chatid"])
+                chats.extend(
+                    {**chat, "agent_id": client.config["agent_id"]}
+                    for chat in client.appchats.as_list()
+                )
+            return {"chats": chats}
+        
+        self.hass.services.async_register(
+            DOMAIN, "create_appchat", create_appchat,
+            supports_response=SupportsResponse.OPTIONAL
+        )
+        self.hass.services.async_register(
+            DOMAIN, "update_appchat", update_appchat
+        )
+        self.hass.services.async_register(
+            DOMAIN, "list_appchats", list_appchats,
+            supports_response=SupportsResponse.ONLY
+        )
+    
+    async def _call_api(self, path, payload):
+        """调用需要Access Token的企业微信接口，成功返回响应数据，失败返回None"""
+        access_token = await self.get_access_token()
+        if not access_token:
+            _LOGGER.error("无法获取有效的Access Token")
+            return None
+        
+        await self.rate_limiter.acquire("message")
+        url = f"{API_BASE}/{path}?access_token={access_token}"
+        try:
+            response = await self.hass.async_add_executor_job(
+                partial(self._request, "POST", url, json=payload)
+            )
+            data = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            _LOGGER.error("调用接口 %s 失败: %s", path, describe_error(e))
+            return None
+        
+        errcode = data.get("errcode")
+        if errcode == 0:
+            return data
+        if errcode in TOKEN_INVALID_ERRCODES:
+            self._token.invalidate()
+        if errcode in RATE_LIMIT_ERRCODES:
+            self.rate_limiter.throttle("message")
+        _LOGGER.error("调用接口 %s 失败: errcode=%s, errmsg=%s", path, errcode, data.get("errmsg"))
+        return None
+    
+    async def update_template_card(self, card_key, template_card=None, replace_name=None):
+        """使用 response_code 原地更新已发送的模板卡片"""
+        card = self.cards.get(card_key)
+        if card is None:
+            _LOGGER.error("未找到模板卡片: %s", card_key)
+            return False
+        response_code = self.cards.consume_response_code(card_key)
+        if not response_code:
+            _LOGGER.debug("模板卡片 %s 没有可用的response_code", card_key)
+            return False
+        
+        payload = {"agentid": self.config["agent_id"], "response_code": response_code}
+        touser = card.get("touser") or ""
+        if touser == "@all":
+            payload["atall"] = 1
+        else:
+            payload["userids"] = [user for user in touser.split("|") if user]
+        if replace_name:
+            payload["button"] = {"replace_name": replace_name}
+        elif template_card:
+            try:
+                # 原地更新沿用卡片发送时的 task_id
+                payload["template_card"] = APP_MESSAGES.build({
+                    "msg_type": "template_card",
+                    "template_card": template_card,
+                    "card_key": card_key,
+                    "task_id": card.get("task_id"),
+                })
+            except vol.Invalid as e:
+                _LOGGER.error("模板卡片参数错误: %s", str(e))
+                return False
+        else:
+            _LOGGER.error("更新模板卡片需要提供 template_card 或 replace_name")
+            return False
+        
+        if await self._call_api("message/update_template_card", payload) is None:
+            return False
+        _LOGGER.info("模板卡片已更新: %s", card_key)
+        return True
+    
+    async def recall_message(self, card_key=None, msgid=None):
+        """撤回消息（按 card_key 或 msgid）"""
+        if card_key:
+            card = self.cards.get(card_key)
+            msgid = card.get("msgid") if card else msgid
+        if not msgid:
+            _LOGGER.error("撤回消息需要有效的 card_key 或 msgid")
+            return False
+        if await self._call_api("message/recall", {"msgid": msgid}) is None:
+            return False
+        if card_key:
+            self.cards.remove(card_key)
+        _LOGGER.info("消息已撤回: %s", msgid)
+        return True
+    
+    async def setup_trace_services(self):
+        """注册追踪记录导出服务"""
+        async def export_traces(call):
+            traces = await self.hass.async_add_executor_job(
+                self.tracer.read,
+                call.data.get("limit", 100),
+                call.data.get("trace_id")
+            )
+            return {"traces": traces}
+        
+        self.hass.services.async_register(
+            DOMAIN, "export_traces", export_traces,
+            supports_response=SupportsResponse.ONLY
+        )
+    
+    async def setup_command_router(self):
+        """加载命令表并注册重新加载服务（所有条目共用，重新加载每个条目的命令表）"""
+        await self.command_router.async_load()
+        if self.hass.services.has_service(DOMAIN, "reload_commands"):
+            return
+        hass = self.hass
+        
+        async def reload_commands(call):
+            for client in list(hass.data.get(DOMAIN, {}).values()):
+                await client.command_router.async_load()
+        
+        self.hass.services.async_register(
+            DOMAIN, "reload_commands", reload_commands
+        )
+    
+    async def setup_card_services(self):
+        """注册模板卡片更新与消息撤回服务（所有条目共用，按 agent_id 或卡片所在条目选择）"""
+        await self.cards.async_load()
+        if self.hass.services.has_service(DOMAIN, "update_template_card"):
+            return
+        hass = self.hass
+        
+        def _card_client(data):
+            # 卡片按应用保存，未指定 agent_id 时使用保存了该卡片的条目
+            if data.get("agent_id") is None and data.get("card_key"):
+                for client in hass.data.get(DOMAIN, {}).values():
+                    if client.cards.get(data["card_key"]):
+                        return client
+            client = _select_client(hass, data.get("agent_id"))
+            if client is None:
+                raise HomeAssistantError(f"未找到应用: {data.get('agent_id')}")
+            return client
+        
+        async def update_template_card(call):
+            await _card_client(call.data).update_template_card(
+                call.data["card_key"],
+                template_card=call.data.get("template_card"),
+                replace_name=call.data.get("replace_name")
+            )
+        
+        async def recall_message(call):
+            await _card_client(call.data).recall_message(
+                card_key=call.data.get("card_key"),
+                msgid=call.data.get("msgid")
+            )
+        
+        self.hass.services.async_register(
+            DOMAIN, "update_template_card", update_template_card
+        )
+        self.hass.services.async_register(
+            DOMAIN, "recall_message", recall_message
+        )
+    
+    async def send_webhook_message(self, _attempt=0, _trace=None, **kwargs):
+        """通过群机器人发送消息（无需Access Token）"""
+        key = kwargs.get("webhook_key") or self.config.get(CONF_WEBHOOK_KEY)
+        if not key:
+            _LOGGER.error("未配置群机器人webhook key")
+            return False
+        
+        msg_type = kwargs.get("msg_type", "text")
+        data = dict(kwargs)
+        file_path = data.get("file_path")
+        try:
+            # 先校验参数，再读取文件或上传
+            WEBHOOK_MESSAGES.validate(data)
+            if msg_type == "image" and file_path:
+                data["image_bytes"] = await self.hass.async_add_executor_job(
+                    self._read_file, file_path, WEBHOOK_IMAGE_MAX_SIZE
+                )
+            elif msg_type == "image" and len(data.get("image_bytes", b"")) > WEBHOOK_IMAGE_MAX_SIZE:
+                raise ValueError("图片过大，群机器人图片消息最大支持2MB")
+            elif msg_type in ("file", "voice") and file_path and not data.get("media_id"):
+                data["media_id"] = await self._upload_webhook_media(
+                    key, msg_type, file_path, data.get("file_name")
+                )
+            payload = {
+                "msgtype": msg_type,
+                msg_type: WEBHOOK_MESSAGES.build(data)
             }
+        except (vol.Invalid, ValueError, OSError) as e:
+            _LOGGER.error("群机器人消息参数错误: %s", str(e))
+            return False
+        
+        _LOGGER.debug("准备通过群机器人发送消息，类型: %s", msg_type)
+        url = f"{API_BASE}/webhook/send?key={key}"
+        response_data = await self._post_message(
+            "webhook", url, payload, None, kwargs, _attempt, _trace
+        )
+        return response_data is not None
+    
+    @staticmethod
+    def _read_file(file_path, max_size):
+        """读取本地文件内容（在线程池中执行）"""
+        file_size = os.path.getsize(file_path)
+        if file_size > max_size:
+            raise ValueError(f"文件过大 ({file_size/(1024 * 1024):.2f}MB)，最大支持{max_size // (1024 * 1024)}MB")
+        with open(file_path, "rb") as file:
+            return file.read()
+    
+    async def _upload_webhook_media(self, key, media_type, file_path, file_name=None):
+        """上传群机器人文件，返回media_id"""
+        url = f"{API_BASE}/webhook/upload_media?key={key}&type={media_type}"
         
-        _LOGGER.debug("准备发送消息到企微通，类型: %s, 代理: %s", msg_type, self.proxies)
+        def _perform_upload():
+            content = self._read_file(file_path, 20 * 1024 * 1024)
+            filename = file_name or os.path.basename(file_path)
+            return self._request(
+                "POST", url, files={"media": (filename, content)}, timeout=30
+            )
+        
+        await self.rate_limiter.acquire("upload")
+        try:
+            response = await self.hass.async_add_executor_job(_perform_upload)
+            data = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            raise ValueError(f"群机器人文件上传失败: {describe_error(e)}")
+        if data.get("errcode") != 0:
+            raise ValueError(f"群机器人文件上传失败: {data.get('errmsg', '未知错误')}")
+        return data["media_id"]
+    
+    async def _post_message(self, api, url, payload, recipients, kwargs, _attempt, trace=None):
+        """限流后发送消息请求，成功时返回响应数据，失败返回None"""
+        with maybe_span(trace, "rate_limit_wait"):
+            await self.rate_limiter.acquire(
+                api, recipients, kwargs.get("priority", "normal")
+            )
         
         def _send_request():
             try:
-                url = f"{API_BASE}/message/send?access_token={access_token}"
-                response = requests.post(url, json=payload, 
-                                        proxies=self.proxies, timeout=10)
+                with maybe_span(trace, "api_call", api=api):
+                    response = self._request(
+                        "POST", url, json=payload, trace=trace
+                    )
                 return response
             except requests.exceptions.Timeout:
                 _LOGGER.error("请求超时")
                 raise
             except requests.exceptions.RequestException as e:
-                _LOGGER.error("请求异常: %s", str(e))
+                _LOGGER.error("请求异常: %s", describe_error(e))
                 raise
         
         try:
             response = await self.hass.async_add_executor_job(_send_request)
         except Exception as e:
-            _LOGGER.error("发送消息时发生异常: %s", str(e))
-            return False
+            _LOGGER.error("发送消息时发生异常: %s", describe_error(e))
+            return None
         
         if response.status_code != 200:
             error_msg = f"发送消息失败，HTTP状态码: {response.status_code}"
             _LOGGER.error(error_msg)
-            return False
+            return None
         
         try:
             response_data = response.json()
         except ValueError:
             _LOGGER.error("无法解析响应JSON: %s", response.text)
-            return False
+            return None
         
-        if response_data.get("errcode") == 0:
+        if api == "message":
+            self._send_times.append(time.monotonic())
+        
+        errcode = response_data.get("errcode")
+        if errcode == 0:
+            self.rate_limiter.recover(api, recipients)
             _LOGGER.info("消息发送成功")
-            return True
+            return response_data
+        
+        if errcode in RATE_LIMIT_ERRCODES:
+            # 触发企业微信频率限制：收紧限流并延迟重试
+            self.rate_limiter.throttle(api, recipients)
+            if _attempt < RATE_LIMIT_MAX_RETRIES:
+                self._schedule_retry(_attempt + 1, kwargs)
+                return None
+        
+        if errcode in TOKEN_INVALID_ERRCODES:
+            # Token 已失效，下次发送时重新获取
+            self._token.invalidate()
             
         error_msg = f"发送消息失败: {response_data.get('errmsg', '未知错误')}"
         _LOGGER.error(error_msg)
@@ -378,7 +1166,19 @@ class WorkChatClient:
         if "invaliduser" in response_data:
             _LOGGER.warning("无效的用户ID: %s", response_data["invaliduser"])
         
-        return False
+        return None
+    
+    def _schedule_retry(self, attempt, kwargs):
+        """在触发频率限制后延迟重发消息"""
+        delay = RATE_LIMIT_RETRY_DELAY * attempt
+        _LOGGER.warning("触发企业微信频率限制，%s秒后第%s次重试", delay, attempt)
+        
+        async def _retry(now):
+            self._retry_unsubs.discard(unsub)
+            await self.send_message(_attempt=attempt, **kwargs)
+        
+        unsub = async_call_later(self.hass, delay, _retry)
+        self._retry_unsubs.add(unsub)
     
     def _calculate_signature(self, token, timestamp, nonce, encrypt):
         token = str(token)
@@ -390,10 +1190,11 @@ class WorkChatClient:
         sign_str = ''.join(params)
         return hashlib.sha1(sign_str.encode()).hexdigest()
     
-    async def handle_callback(self, data):
+    async def handle_callback(self, data, trace=None):
         required = ["msg_signature", "timestamp", "nonce", "encrypt"]
         if not all(k in data for k in required):
             _LOGGER.error("回调数据缺失必要字段: %s", data)
+            self.count_rejection("missing_signature")
             return "Invalid request", 400
         
         signature = str(data["msg_signature"])
@@ -401,25 +1202,52 @@ class WorkChatClient:
         nonce = str(data["nonce"])
         encrypt = str(data["encrypt"])
         
-        calc_sign = self._calculate_signature(
-            self.config["token"], timestamp, nonce, encrypt
-        )
+        with maybe_span(trace, "signature"):
+            calc_sign = self._calculate_signature(
+                self.config["token"], timestamp, nonce, encrypt
+            )
         
         if calc_sign != signature:
             _LOGGER.warning("签名验证失败! 收到签名: %s, 计算签名: %s", signature, calc_sign)
+            self.count_rejection("bad_signature")
             return "签名验证失败", 400
         
         try:
-            decrypted = self.encryptor.Decrypt(encrypt)
+            with maybe_span(trace, "decrypt"):
+                decrypted = self.encryptor.Decrypt(encrypt)
         except Exception as e:
             _LOGGER.error("解密失败: %s", str(e))
+            self.count_rejection("decrypt_failed")
             return "解密失败", 400
         
+        with maybe_span(trace, "parse"):
+            event_data = self._parse_message(decrypted)
+        if event_data is None:
+            self.count_rejection("parse_failed")
+            return "XML解析失败", 400
+        
+        if trace is not None:
+            event_data["trace_id"] = trace.trace_id
+        
+        with maybe_span(trace, "dispatch"):
+            # 命中命令表时触发 workchat_command 事件（或直接调用服务）
+            command = self.command_router.dispatch(event_data)
+            if command:
+                event_data["command"] = command
+            
+            if event_data["type"] == "template_card_event":
+                self.hass.bus.async_fire("workchat_card_event", event_data)
+            self.hass.bus.async_fire("workchat_message", event_data)
+        
+        return self._generate_response("success")
+    
+    def _parse_message(self, decrypted):
+        """解析解密后的消息XML为事件数据，解析失败返回None"""
         try:
             xml_tree = ET.fromstring(decrypted)
         except ET.ParseError as e:
             _LOGGER.error("XML解析失败: %s", str(e))
-            return "XML解析失败", 400
+            return None
         
         msg_type = xml_tree.find("MsgType").text
         user_id = xml_tree.find("FromUserName").text
@@ -456,10 +1284,41 @@ class WorkChatClient:
                     "type": "menu_click",
                     "event_key": event_key
                 })
+            elif event_type == "LOCATION":
+                # 成员进入应用后定时上报的地理位置
+                event_data.update({
+                    "type": "location_report",
+                    "lat": xml_tree.findtext("Latitude"),
+                    "lon": xml_tree.findtext("Longitude"),
+                    "precision": xml_tree.findtext("Precision")
+                })
+            elif event_type == "template_card_event":
+                self._handle_card_event(xml_tree, event_data)
         
-        self.hass.bus.async_fire("workchat_message", event_data)
-        
-        return self._generate_response("success")
+        return event_data
+    
+    def _handle_card_event(self, xml_tree, event_data):
+        """解析模板卡片交互事件，并记录新的 response_code"""
+        task_id = xml_tree.findtext("TaskId")
+        response_code = xml_tree.findtext("ResponseCode")
+        card_key = self.cards.resolve(task_id) if task_id else None
+        selected_items = [
+            {
+                "question_key": item.findtext("QuestionKey"),
+                "option_ids": [opt.text for opt in item.findall("OptionIds/OptionId")]
+            }
+            for item in xml_tree.findall("SelectedItems/SelectedItem")
+        ]
+        event_data.update({
+            "type": "template_card_event",
+            "card_key": card_key or task_id,
+            "task_id": task_id,
+            "event_key": xml_tree.findtext("EventKey"),
+            "card_type": xml_tree.findtext("CardType"),
+            "selected_items": selected_items
+        })
+        if card_key and response_code:
+            self.cards.update_response_code(card_key, response_code)
     
     def _generate_response(self, content):
         timestamp = str(int(time.time()))